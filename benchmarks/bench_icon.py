@@ -0,0 +1,104 @@
+"""
+Benchmark icon mask rendering against the previous per-point renderer.
+
+Usage: python benchmarks/bench_icon.py [--sizes 1024 4096]
+"""
+import argparse
+import sys
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageChops, ImageDraw
+from svgpathtools import parse_path
+
+ICON_DIR = Path(__file__).resolve().parent.parent / "icon"
+sys.path.insert(0, str(ICON_DIR))
+
+import rendering
+
+
+def legacy_get_icon_mask(icon_path, width=1024, height=1024, curve_steps=20):
+    # The previous icon/render.py mask, kept for comparison
+    final_mask = Image.new("1", (width, height), 0)
+    mask_size = min(width, height)
+    square_mask = Image.new("1", (mask_size, mask_size), 0)
+
+    root = ET.parse(icon_path).getroot()
+    vb_x, vb_y, vb_w, vb_h = map(float, root.get("viewBox", "0 0 100 100").split())
+    scale = mask_size / max(vb_w, vb_h)
+    ns = {"svg": "http://www.w3.org/2000/svg"}
+
+    for path_elem in root.findall(".//svg:path", ns):
+        d = path_elem.get("d")
+        if not d:
+            continue
+        for subpath in parse_path(d).continuous_subpaths():
+            polygon = []
+            for segment in subpath:
+                for t in np.linspace(0, 1, curve_steps, endpoint=False):
+                    pt = segment.point(t)
+                    polygon.append(((pt.real - vb_x) * scale, (pt.imag - vb_y) * scale))
+            end = subpath[-1].end
+            polygon.append(((end.real - vb_x) * scale, (end.imag - vb_y) * scale))
+            if len(polygon) < 3:
+                continue
+            temp = Image.new("1", (mask_size, mask_size), 0)
+            ImageDraw.Draw(temp).polygon(polygon, fill=1)
+            square_mask = ImageChops.logical_xor(square_mask, temp)
+
+    bbox = square_mask.getbbox()
+    if bbox is None:
+        return final_mask.convert("L")
+    left, top, right, bottom = bbox
+    offset_x = width // 2 - (left + (right - left) // 2)
+    offset_y = height // 2 - (top + (bottom - top) // 2)
+    final_mask.paste(square_mask, (offset_x, offset_y))
+    return final_mask.convert("L")
+
+
+def time_call(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 4096])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--icon", default=str(ICON_DIR / "icon_outline.svg"))
+    args = parser.parse_args()
+
+    print(f"{'size':>6} {'legacy':>10} {'cold':>10} {'cached':>10} {'speedup':>8} {'pixels differing':>17}")
+    for size in args.sizes:
+        legacy_s, legacy_mask = time_call(lambda: legacy_get_icon_mask(args.icon, size, size), args.repeat)
+
+        def cold():
+            rendering.clear_cache()
+            return rendering.get_icon_mask(args.icon, size, size)
+
+        cold_s, mask = time_call(cold, args.repeat)
+        cached_s, _ = time_call(lambda: rendering.get_icon_mask(args.icon, size, size), args.repeat)
+        differing = (np.asarray(legacy_mask) != np.asarray(mask)).mean()
+        print(
+            f"{size:>6} {legacy_s * 1000:>8.1f}ms {cold_s * 1000:>8.1f}ms {cached_s * 1000:>8.2f}ms "
+            f"{legacy_s / cold_s:>7.1f}x {differing:>16.3%}"
+        )
+
+    rendering.clear_cache()
+    start = time.perf_counter()
+    images = rendering.render_icons(args.icon, rendering.DISCORD_AVATAR_SIZES, ("rainbow", "monochrome"))
+    batch_s = time.perf_counter() - start
+    print(
+        f"\nbatch: {len(images)} images ({len(rendering.DISCORD_AVATAR_SIZES)} avatar sizes x 2 variants) "
+        f"in {batch_s * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
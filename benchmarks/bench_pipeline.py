@@ -0,0 +1,182 @@
+"""
+Drive on_message and the slash commands with synthetic Discord objects
+against a local mock upstream, and report throughput, latency percentiles
+and memory.
+
+Usage: python benchmarks/bench_pipeline.py --requests 200 --concurrency 20 --latency-ms 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import mock_server
+from fakes import FakeChannel, FakeInteraction, FakeUser
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def load_bot(base_url, overrides):
+    """
+    Import main with a config pointing at the mock upstream. main reads
+    config.json from the working directory, so a patched copy is written
+    to a temp dir first.
+    """
+    with open(REPO_ROOT / "config.json", "r") as f:
+        config = json.load(f)
+    config.update(server_url=base_url, search_url=base_url, metrics_port=None)
+    config.update(overrides)
+
+    workdir = tempfile.mkdtemp(prefix="disgrok-bench-")
+    with open(Path(workdir) / "config.json", "w") as f:
+        json.dump(config, f)
+    os.chdir(workdir)
+    os.environ.setdefault("HACKCLUB_AI_API_KEY", "bench")
+    os.environ.setdefault("HACKCLUB_SEARCH_API_KEY", "bench")
+
+    import main
+    main.client._connection.user = FakeChannel.bot_user
+    return main
+
+
+async def run_mention(main, channel, user, idx):
+    message = channel.add_message(user, f"<@{FakeChannel.bot_user.id}> benchmark question number {idx}?")
+    sent_before = len(channel.sent)
+    await main.on_message(message)
+    return len(channel.sent) > sent_before and not channel.sent[-1].content.startswith(":x:")
+
+
+async def run_gen_image(main, channel, user, idx):
+    command = main.tree.get_command("gen_image")
+    interaction = FakeInteraction(user=user, channel=channel)
+    await command.callback(interaction, prompt=f"benchmark image {idx}")
+    return any(content and not content.startswith(":x:") for content, _, _ in interaction.sent)
+
+
+async def run_tts(main, channel, user, idx):
+    command = main.tree.get_command("tts")
+    interaction = FakeInteraction(user=user, channel=channel)
+    await command.callback(interaction, voice="Ryan", prompt=f"benchmark sentence {idx}")
+    return any(kwargs.get("file") for _, _, kwargs in interaction.sent)
+
+
+ICON_THEMES = ("rainbow", "monochrome", "ocean", "sunset")
+
+
+async def run_icon(main, channel, user, idx):
+    command = main.tree.get_command("icon")
+    interaction = FakeInteraction(user=user, channel=channel)
+    # Cycles through 12 theme and size combinations, so most requests hit the cache
+    theme = ICON_THEMES[idx % len(ICON_THEMES)]
+    size = (128, 256, 512)[idx // len(ICON_THEMES) % 3]
+    await command.callback(interaction, theme=theme, size=size, kind="avatar")
+    return any(kwargs.get("file") for _, _, kwargs in interaction.sent)
+
+
+SCENARIOS = {
+    "mention": run_mention,
+    "gen_image": run_gen_image,
+    "tts": run_tts,
+    "icon": run_icon,
+}
+
+
+async def run_benchmark(main, scenario, total, concurrency, channels, users):
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    channel_pool = [FakeChannel() for _ in range(channels)]
+    user_pool = [FakeUser(f"user{i}") for i in range(users)]
+    for channel in channel_pool:
+        for i in range(20):
+            channel.add_message(user_pool[i % len(user_pool)], f"warm-up history message {i}")
+
+    async def one(idx):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                ok = await SCENARIOS[scenario](main, channel_pool[idx % channels], user_pool[idx % users], idx)
+            except Exception as e:
+                print(f"{scenario} request {idx} raised: {e!r}")
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(idx) for idx in range(total)))
+    elapsed = time.perf_counter() - start
+    # Writes are normally flushed by a background task started in on_ready
+    if main.replay_log is not None:
+        await main.replay_log.flush()
+    return sorted(latencies), failures, elapsed
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mention")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--config", action="append", default=[], metavar="KEY=JSON",
+                        help="Override a config value, e.g. --config msg_context_length=20")
+    mock_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    overrides = {}
+    for item in args.config:
+        key, value = item.split("=", 1)
+        overrides[key] = json.loads(value)
+
+    if args.scenario == "icon":
+        overrides.setdefault("command_modules", ["icons"])
+        overrides.setdefault("icon_cache_dir", None)
+
+    upstream = mock_server.upstream_from_args(args)
+    base_url = mock_server.start_in_thread(upstream)
+
+    tracemalloc.start()
+    bot = load_bot(base_url, overrides)
+    latencies, failures, elapsed = asyncio.run(
+        run_benchmark(bot, args.scenario, args.requests, args.concurrency, args.channels, args.users)
+    )
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"scenario      {args.scenario}")
+    print(f"requests      {args.requests} ({failures} failed), concurrency {args.concurrency}")
+    print(f"upstream      {upstream.requests} calls, {upstream.errors} injected errors, "
+          f"median latency {args.latency_ms:.0f} ms")
+    print(f"throughput    {args.requests / elapsed:.1f} req/s over {elapsed:.2f} s")
+    print(f"latency p50   {percentile(latencies, 50) * 1000:.1f} ms")
+    print(f"latency p95   {percentile(latencies, 95) * 1000:.1f} ms")
+    print(f"latency p99   {percentile(latencies, 99) * 1000:.1f} ms")
+    print(f"memory        peak traced {peak / 1e6:.1f} MB, max RSS {max_rss_mb:.0f} MB")
+    if args.scenario == "icon":
+        from c_icons import get_icon_cache_stats
+
+        stats = get_icon_cache_stats()
+        print(f"icon cache    {stats['hit_rate']:.0%} hit rate ({stats['memory']} memory, "
+              f"{stats['disk']} disk, {stats['coalesced']} coalesced, {stats['miss']} rendered)")
+
+
+if __name__ == "__main__":
+    main_cli()
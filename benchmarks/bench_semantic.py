@@ -0,0 +1,97 @@
+"""
+Benchmark semantic index updates and queries on a large channel.
+
+Usage: python benchmarks/bench_semantic.py --messages 1000000
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from semantic_index import SemanticIndex
+
+
+WORDS = (
+    "discord bot python image model server deploy error latency cache search news music game "
+    "linux windows gpu cuda memory token prompt voice audio update release weekend meeting "
+    "question answer bug feature docs config shard guild channel message reply thread"
+).split()
+
+
+def make_texts(count, rng):
+    return [
+        f"user{rng.randrange(50)}: " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 20)))
+        for _ in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory(prefix="disgrok-semantic-") as root:
+        index = SemanticIndex(root)
+        channel_id = 1
+
+        embed_seconds = 0.0
+        append_seconds = 0.0
+        for start in range(0, args.messages, args.batch_size):
+            texts = make_texts(min(args.batch_size, args.messages - start), rng)
+            t0 = time.perf_counter()
+            vectors = index._get_embedder().embed(texts)
+            t1 = time.perf_counter()
+            index._channel(channel_id).add(range(start + 1, start + 1 + len(texts)), vectors)
+            t2 = time.perf_counter()
+            embed_seconds += t1 - t0
+            append_seconds += t2 - t1
+
+        # Single-message updates are what on_message does between flushes
+        single = []
+        for idx in range(200):
+            t0 = time.perf_counter()
+            index._index_batch([(channel_id, args.messages + idx + 1, make_texts(1, rng)[0])])
+            single.append(time.perf_counter() - t0)
+
+        latencies = []
+        for query in make_texts(args.queries, rng):
+            t0 = time.perf_counter()
+            index._search(channel_id, query, args.top_k, None)
+            latencies.append(time.perf_counter() - t0)
+
+        latencies.sort()
+        single.sort()
+        per_message_us = (embed_seconds + append_seconds) / args.messages * 1e6
+        print(f"messages        {args.messages}")
+        print(f"bulk update     {per_message_us:.1f} us/message "
+              f"(embed {embed_seconds:.1f}s, append {append_seconds:.1f}s)")
+        print(f"single update   p50 {single[len(single) // 2] * 1000:.2f} ms")
+        print(f"query           p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms")
+
+        # Recall of the LSH candidate stage against exact search on a sample
+        channel = index._channel(channel_id)
+        vectors = np.asarray(channel._mapped()[0], dtype=np.float32)
+        hits = 0
+        total = 0
+        for query in make_texts(20, rng):
+            query_vector = index._get_embedder().embed([query])[0]
+            exact = set(np.argsort(-(vectors @ query_vector))[:args.top_k] + 1)
+            approx = {message_id for message_id, _ in channel.search(query_vector, top_k=args.top_k)}
+            hits += len(exact & approx)
+            total += args.top_k
+        print(f"recall@{args.top_k}        {hits / total:.0%} (vs exact search, 20 queries)")
+
+
+if __name__ == "__main__":
+    main()
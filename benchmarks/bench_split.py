@@ -0,0 +1,67 @@
+"""
+Benchmark response splitting on large markdown outputs.
+
+Usage: python benchmarks/bench_split.py
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from helpers import split_message
+
+
+def legacy_split(message, message_max_length=2000):
+    # The previous split_send chunking, kept for comparison
+    messages = []
+    while len(message) > message_max_length:
+        snippet = message[0:message_max_length]
+        split_snippet = snippet.split("\n")
+        remaining = '\n'.join(split_snippet[0:-1]) if len(split_snippet) > 1 else snippet
+        return_snippet = ''.join(split_snippet[-1:]) if len(split_snippet) > 1 else ''
+        messages.append(remaining)
+        message = return_snippet + message[message_max_length:]
+    messages.append(message)
+    return [msg for msg in messages if msg]
+
+
+def make_markdown(target_size, seed=0):
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    while size < target_size:
+        if rng.random() < 0.2:
+            lines = [f"value_{i} = compute({i})  # {'x' * rng.randint(0, 60)}" for i in range(rng.randint(5, 80))]
+            part = "```python\n" + "\n".join(lines) + "\n```"
+        else:
+            words = [rng.choice(["lorem", "ipsum", "dolor", "sit", "amet."]) for _ in range(rng.randint(20, 400))]
+            part = " ".join(words)
+        parts.append(part)
+        size += len(part) + 2
+    return "\n\n".join(parts)
+
+
+def time_call(fn, text, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best, chunks
+
+
+def count_broken_fences(chunks):
+    return sum(1 for chunk in chunks if chunk.count("```") % 2)
+
+
+if __name__ == "__main__":
+    for size_kb in (100, 300, 600):
+        text = make_markdown(size_kb * 1000)
+        for name, fn in (("legacy", legacy_split), ("split_message", split_message)):
+            elapsed, chunks = time_call(fn, text)
+            print(
+                f"{size_kb:>4} KB  {name:<14} {elapsed * 1000:8.2f} ms  "
+                f"{len(chunks):4d} chunks  {count_broken_fences(chunks):3d} broken fences"
+            )
@@ -0,0 +1,99 @@
+"""
+Stand-in for the Discord gateway when running shard processes locally.
+Each process only handles the synthetic guilds that Discord would route
+to its shards, against a mock upstream, with the shared SQLite cache.
+
+Normally started by `python launcher.py --shards N --fake-gateway`.
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import mock_server
+from bench_pipeline import REPO_ROOT, load_bot, percentile
+from fakes import FakeAttachment, FakeChannel, FakeGuild, FakeUser
+
+
+def shard_for_guild(guild_id, shard_count):
+    # Same routing formula the Discord gateway uses
+    return (guild_id >> 22) % shard_count
+
+
+def make_images(count, size=1600):
+    from PIL import Image
+
+    images = []
+    for idx in range(count):
+        img = Image.new("RGB", (size, size), ((idx * 53) % 256, (idx * 97) % 256, (idx * 193) % 256))
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+async def drive(main, args):
+    shard_ids = main.SHARD_IDS or [0]
+    shard_count = main.SHARD_COUNT or 1
+    guilds = [FakeGuild(guild_id=(idx + 1) << 22 | idx) for idx in range(args.guilds)]
+    owned = [guild for guild in guilds if shard_for_guild(guild.id, shard_count) in shard_ids]
+    images = make_images(args.images)
+    users = [FakeUser(f"user{idx}") for idx in range(10)]
+
+    latencies = []
+
+    async def guild_traffic(guild_idx, guild):
+        channel = FakeChannel(guild=guild)
+        for msg_idx in range(args.messages):
+            # The same few images show up in every guild, so shards can reuse each other's work
+            image = images[(guild_idx + msg_idx) % len(images)]
+            message = channel.add_message(
+                users[msg_idx % len(users)],
+                f"<@{FakeChannel.bot_user.id}> what is in this picture?",
+                attachments=[FakeAttachment(image)],
+            )
+            start = time.perf_counter()
+            await main.on_message(message)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(guild_traffic(guilds.index(guild), guild) for guild in owned))
+    elapsed = time.perf_counter() - start
+
+    import helpers
+
+    cache = helpers._processed_image_cache
+    lookups = cache.hits + cache.misses
+    latencies.sort()
+    print(
+        f"[pid {os.getpid()} shards {shard_ids}] {len(owned)}/{len(guilds)} guilds, "
+        f"{len(latencies)} messages in {elapsed:.2f}s, p50 {percentile(latencies, 50) * 1000:.0f} ms, "
+        f"image cache hit rate {cache.hits / lookups if lookups else 0:.0%}"
+    )
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=5, help="Mentions per guild")
+    parser.add_argument("--images", type=int, default=3, help="Distinct images shared across guilds")
+    parser.add_argument("--cache-path", default=str(REPO_ROOT / "cache" / "fake_gateway_cache.sqlite3"))
+    mock_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    upstream = mock_server.upstream_from_args(args)
+    base_url = mock_server.start_in_thread(upstream)
+    bot = load_bot(base_url, {
+        "shared_cache_backend": "sqlite",
+        "shared_cache_path": os.path.abspath(args.cache_path),
+    })
+    asyncio.run(drive(bot, args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,140 @@
+"""
+Minimal stand-ins for the discord.py objects the bot touches, so handlers
+can be driven without a gateway connection.
+"""
+import asyncio
+import itertools
+from datetime import datetime, timezone
+
+
+_ids = itertools.count(1_000_000)
+
+
+def next_id():
+    return next(_ids)
+
+
+class FakeUser:
+    def __init__(self, name, user_id=None, bot=False):
+        self.id = user_id or next_id()
+        self.name = name
+        self.bot = bot
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, guild_id=None):
+        self.id = guild_id or next_id()
+
+
+class FakeAttachment:
+    def __init__(self, data, filename="image.png", content_type="image/png"):
+        self.id = next_id()
+        self.filename = filename
+        self.content_type = content_type
+        self.url = f"https://cdn.example.invalid/{self.id}/{filename}"
+        self.size = len(data)
+        self._data = data
+
+    async def read(self):
+        return self._data
+
+    async def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self._data)
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content, attachments=None, reference=None):
+        self.id = next_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.attachments = attachments or []
+        self.reference = reference
+        self.created_at = datetime.now(timezone.utc)
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content, reference=self, **kwargs)
+
+    async def fetch_reference(self):
+        return self.reference.resolved
+
+
+class FakeReference:
+    def __init__(self, message):
+        self.message_id = message.id
+        self.resolved = message
+
+
+class FakeChannel:
+    def __init__(self, guild=None, channel_id=None, send_latency=0.0):
+        self.id = channel_id or next_id()
+        self.guild = guild or FakeGuild()
+        self.messages = []
+        self.sent = []
+        self.send_latency = send_latency
+
+    def add_message(self, author, content, **kwargs):
+        message = FakeMessage(self, author, content, **kwargs)
+        self.messages.append(message)
+        return message
+
+    async def history(self, limit=100):
+        for message in reversed(self.messages[-limit:]):
+            yield message
+
+    async def send(self, content=None, **kwargs):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        message = FakeMessage(self, FakeChannel.bot_user, content or "")
+        message.files = kwargs.get("files") or ([kwargs["file"]] if kwargs.get("file") else [])
+        self.messages.append(message)
+        self.sent.append(message)
+        return message
+
+
+FakeChannel.bot_user = FakeUser("disGrok", bot=True)
+
+
+class FakeInteractionResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self.deferred = False
+
+    async def defer(self, thinking=False, ephemeral=False):
+        self.deferred = True
+
+    async def send_message(self, content=None, ephemeral=False, **kwargs):
+        self._interaction.sent.append((content, ephemeral, kwargs))
+
+    def is_done(self):
+        return self.deferred or bool(self._interaction.sent)
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, ephemeral=False, **kwargs):
+        self._interaction.sent.append((content, ephemeral, kwargs))
+
+
+class FakeInteraction:
+    def __init__(self, user=None, channel=None):
+        self.user = user or FakeUser("user")
+        self.channel = channel or FakeChannel()
+        self.guild = self.channel.guild
+        self.guild_id = self.guild.id
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
+        self.sent = []
@@ -0,0 +1,154 @@
+"""
+Local stand-in for the AI proxy and search.hackclub.com with configurable
+latency and error distributions.
+
+Usage: python benchmarks/mock_server.py --port 8765 --latency-ms 300 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import threading
+
+from aiohttp import web
+
+
+# 1x1 transparent PNG returned for image generation requests
+TINY_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+PLANNER_TEXT = "General Query: example query\nNews Query: example news\nImage Query: example image"
+
+
+class MockUpstream:
+    def __init__(self, latency_ms=200.0, jitter=0.5, error_rate=0.0, answer_size=1500, seed=None):
+        self.latency_ms = latency_ms
+        # Sigma of the log-normal latency distribution; 0 means fixed latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.answer_size = answer_size
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+
+    async def _delay(self):
+        if self.latency_ms <= 0:
+            return
+        latency = self.latency_ms * (self._rng.lognormvariate(0, self.jitter) if self.jitter else 1.0)
+        await asyncio.sleep(latency / 1000)
+
+    async def _maybe_fail(self):
+        self.requests += 1
+        await self._delay()
+        if self._rng.random() < self.error_rate:
+            self.errors += 1
+            raise web.HTTPServiceUnavailable(text="mock upstream error")
+
+    def _answer(self, payload):
+        text = json.dumps(payload)
+        if "Format your response as follows" in text or "General Query" in text:
+            return PLANNER_TEXT
+        filler = "This is a mock answer from the benchmark upstream. "
+        return (filler * (self.answer_size // len(filler) + 1))[: self.answer_size]
+
+    async def responses(self, request):
+        payload = await request.json()
+        await self._maybe_fail()
+        return web.json_response({
+            "output": [{
+                "type": "message",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": self._answer(payload)}],
+            }]
+        })
+
+    async def chat_completions(self, request):
+        payload = await request.json()
+        await self._maybe_fail()
+        message = {"role": "assistant", "content": self._answer(payload)}
+        if "image" in payload.get("modalities", []):
+            data_url = "data:image/png;base64," + base64.b64encode(TINY_PNG).decode("ascii")
+            message = {"role": "assistant", "content": "", "images": [{"image_url": {"url": data_url}}]}
+        return web.json_response({"choices": [{"message": message}]})
+
+    async def web_search(self, request):
+        await self._maybe_fail()
+        count = int(request.query.get("count", 5))
+        return web.json_response({"web": {"results": [
+            {"title": f"Result {i}", "meta_url": {"hostname": "example.com"}, "description": "Mock result."}
+            for i in range(count)
+        ]}})
+
+    async def news_search(self, request):
+        await self._maybe_fail()
+        count = int(request.query.get("count", 5))
+        return web.json_response({"results": [
+            {"title": f"News {i}", "meta_url": {"hostname": "example.com"}, "description": "Mock news.", "age": "1h"}
+            for i in range(count)
+        ]})
+
+    async def image_search(self, request):
+        await self._maybe_fail()
+        return web.json_response({"results": [{"properties": {"url": "https://example.com/image.png"}}]})
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/responses", self.responses)
+        app.router.add_post("/chat/completions", self.chat_completions)
+        app.router.add_get("/res/v1/web/search", self.web_search)
+        app.router.add_get("/res/v1/news/search", self.news_search)
+        app.router.add_get("/res/v1/images/search", self.image_search)
+        return app
+
+
+def start_in_thread(upstream, host="127.0.0.1", port=0):
+    """
+    Serve the mock on its own event loop in a daemon thread, so blocking
+    calls on the caller's loop can't stall it. Returns the base URL.
+    """
+    ready = threading.Event()
+    address = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(upstream.make_app())
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, host, port)
+        loop.run_until_complete(site.start())
+        address["port"] = site._server.sockets[0].getsockname()[1]
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return f"http://{host}:{address['port']}"
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Median upstream latency")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Sigma of the log-normal latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of upstream requests that fail")
+    parser.add_argument("--answer-size", type=int, default=1500, help="Characters in each mock model answer")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def upstream_from_args(args):
+    return MockUpstream(
+        latency_ms=args.latency_ms,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        answer_size=args.answer_size,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(upstream_from_args(args).make_app(), host=args.host, port=args.port)
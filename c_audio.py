@@ -4,11 +4,16 @@ import traceback
 from pathlib import Path
 import tempfile
 
+import aiohttp
 import discord
 from discord import app_commands
-import soundfile as sf
-import torch
-from qwen_tts import Qwen3TTSModel
+
+import metrics
+import ratelimit
+import settings
+import tracing
+from helpers import get_inference_session
+from singleflight import SingleFlight
 
 
 SUPPORTED_VOICES = [
@@ -23,9 +28,13 @@ SUPPORTED_VOICES = [
 	"Sohee",
 ]
 
+# Loaded models are kept with their names so a config reload only
+# reloads weights when the configured model actually changed
 _tts_model = None
+_tts_model_name = None
 _tts_model_lock = asyncio.Lock()
 _voice_clone_model = None
+_voice_clone_model_name = None
 _voice_clone_model_lock = asyncio.Lock()
 _tts_generation_lock = asyncio.Lock()
 
@@ -42,6 +51,10 @@ def _resolve_voice(voice):
 
 
 def _load_tts_model(model_name):
+	# The ML stack is imported on first use so the text-only path never pays for it
+	import torch
+	from qwen_tts import Qwen3TTSModel
+
 	device_map = "cuda:0" if torch.cuda.is_available() else "cpu"
 	dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
 	attn_impl = "flash_attention_2" if torch.cuda.is_available() else "eager"
@@ -63,25 +76,35 @@ def _load_tts_model(model_name):
 		)
 
 
+def _tts_model_for(config):
+	return config.get("tts_model", "Qwen/Qwen3-TTS-12Hz-0.6B-CustomVoice")
+
+
 async def _get_tts_model(config):
-	global _tts_model
-	if _tts_model is not None:
+	global _tts_model, _tts_model_name
+	model_name = _tts_model_for(config)
+	if _tts_model is not None and _tts_model_name == model_name:
 		return _tts_model
 
 	async with _tts_model_lock:
-		if _tts_model is not None:
+		if _tts_model is not None and _tts_model_name == model_name:
 			return _tts_model
 
-		model_name = config.get("tts_model", "Qwen/Qwen3-TTS-12Hz-0.6B-CustomVoice")
+		if _tts_model is not None:
+			print(f"TTS model changed from {_tts_model_name} to {model_name}, reloading")
 		loop = asyncio.get_event_loop()
-		_tts_model = await loop.run_in_executor(
-			None,
-			lambda: _load_tts_model(model_name),
-		)
+		with metrics.timed("tts_model_load"), tracing.span("tts_model_load", model=model_name):
+			_tts_model = await loop.run_in_executor(
+				None,
+				lambda: _load_tts_model(model_name),
+			)
+		_tts_model_name = model_name
 		return _tts_model
 
 
 def _synthesize_wav(model, text, voice):
+	import soundfile as sf
+
 	wavs, sr = model.generate_custom_voice(
 		text=text,
 		language="Auto",
@@ -93,21 +116,42 @@ def _synthesize_wav(model, text, voice):
 	return buffer
 
 
+def _synthesize_wav_batch(model, texts, voices):
+	import soundfile as sf
+
+	wavs, sr = model.generate_custom_voice(
+		text=list(texts),
+		language=["Auto"] * len(texts),
+		speaker=list(voices),
+	)
+	buffers = []
+	for wav in wavs:
+		buffer = io.BytesIO()
+		sf.write(buffer, wav, sr, format="WAV")
+		buffer.seek(0)
+		buffers.append(buffer)
+	return buffers
+
+
 async def _get_voice_clone_model(config):
-	global _voice_clone_model
-	if _voice_clone_model is not None:
+	global _voice_clone_model, _voice_clone_model_name
+	model_name = config.get("voice_clone_model", "Qwen/Qwen3-TTS-12Hz-1.7B-Base")
+	if _voice_clone_model is not None and _voice_clone_model_name == model_name:
 		return _voice_clone_model
 
 	async with _voice_clone_model_lock:
-		if _voice_clone_model is not None:
+		if _voice_clone_model is not None and _voice_clone_model_name == model_name:
 			return _voice_clone_model
 
-		model_name = config.get("voice_clone_model", "Qwen/Qwen3-TTS-12Hz-1.7B-Base")
+		if _voice_clone_model is not None:
+			print(f"Voice clone model changed from {_voice_clone_model_name} to {model_name}, reloading")
 		loop = asyncio.get_event_loop()
-		_voice_clone_model = await loop.run_in_executor(
-			None,
-			lambda: _load_tts_model(model_name),
-		)
+		with metrics.timed("voice_clone_model_load"), tracing.span("voice_clone_model_load", model=model_name):
+			_voice_clone_model = await loop.run_in_executor(
+				None,
+				lambda: _load_tts_model(model_name),
+			)
+		_voice_clone_model_name = model_name
 		return _voice_clone_model
 
 
@@ -122,6 +166,8 @@ def _synthesize_voice_clone(model, text, ref_audio_path, ref_text=None, language
 		ref_text: Transcription of the reference audio (optional, uses x_vector_only_mode if not provided)
 		language: Language for synthesis
 	"""
+	import soundfile as sf
+
 	# Use x_vector_only_mode if no reference text is provided
 	if ref_text is None:
 		wavs, sr = model.generate_voice_clone(
@@ -144,6 +190,43 @@ def _synthesize_voice_clone(model, text, ref_audio_path, ref_text=None, language
 	return buffer
 
 
+async def _remote_tts(inference_url, text, voice):
+	async with get_inference_session().post(
+		f"{inference_url.rstrip('/')}/tts",
+		json={"text": text, "voice": voice},
+	) as response:
+		response.raise_for_status()
+		return io.BytesIO(await response.read())
+
+
+async def _remote_voice_clone(inference_url, text, audio_bytes, filename, ref_text=None):
+	form = aiohttp.FormData()
+	form.add_field("text", text)
+	if ref_text is not None:
+		form.add_field("ref_text", ref_text)
+	form.add_field("audio", audio_bytes, filename=filename)
+	async with get_inference_session().post(
+		f"{inference_url.rstrip('/')}/voice_clone",
+		data=form,
+	) as response:
+		response.raise_for_status()
+		return io.BytesIO(await response.read())
+
+
+async def warm_up_audio(config):
+	"""
+	Load the TTS model in the background so the first /tts doesn't wait for it.
+	"""
+	if config.get("inference_url"):
+		return
+	try:
+		await _get_tts_model(config)
+		print("TTS model warmed up")
+	except Exception as e:
+		print(f"Error warming up TTS model: {e}")
+		metrics.record_error("tts_model_load", e)
+
+
 def setup_audio_commands(tree, config):
 	voice_choices = [
 		app_commands.Choice(name="Vivian", value="Vivian"),
@@ -157,10 +240,37 @@ def setup_audio_commands(tree, config):
 		app_commands.Choice(name="Sohee", value="Sohee"),
 	]
 
+	# The same model, voice and text requested concurrently is only synthesized once
+	tts_flight = SingleFlight("tts")
+
+	async def synthesize(config, prompt, voice):
+		# When set, synthesis runs in inference_server.py instead of this process
+		inference_url = config.get("inference_url")
+		if inference_url:
+			with metrics.timed("tts_remote"), tracing.span("tts_remote", voice=voice):
+				audio_buffer = await _remote_tts(inference_url, prompt, voice)
+		else:
+			model = await _get_tts_model(config)
+			loop = asyncio.get_event_loop()
+
+			async with _tts_generation_lock:
+				with metrics.timed("tts_generation"), tracing.span("tts_generation", voice=voice):
+					audio_buffer = await loop.run_in_executor(
+						None,
+						lambda: _synthesize_wav(model, prompt, voice),
+					)
+		# Bytes rather than the buffer, since every waiting caller sends its own file
+		return audio_buffer.getvalue()
+
 	@tree.command(name="tts", description="Speak text with a selected voice")
 	@app_commands.describe(voice="Voice to use", prompt="Text to speak")
 	@app_commands.choices(voice=voice_choices)
 	async def tts(interaction: discord.Interaction, voice: str, prompt: str):
+		if not await ratelimit.check_interaction(interaction, "tts"):
+			return
+
+		config = settings.for_guild(interaction.guild_id)
+
 		await interaction.response.defer(thinking=True)
 
 		resolved_voice = _resolve_voice(voice)
@@ -172,27 +282,25 @@ def setup_audio_commands(tree, config):
 			return
 
 		try:
-			model = await _get_tts_model(config)
-			loop = asyncio.get_event_loop()
-
-			async with _tts_generation_lock:
-				audio_buffer = await loop.run_in_executor(
-					None,
-					lambda: _synthesize_wav(model, prompt, resolved_voice),
+			with tracing.start_trace("tts", user_id=interaction.user.id, voice=resolved_voice):
+				audio_bytes = await tts_flight.do(
+					(config.get("inference_url"), _tts_model_for(config), resolved_voice, prompt),
+					lambda: synthesize(config, prompt, resolved_voice),
 				)
 
-			audio_file = discord.File(audio_buffer, filename=f"tts_{resolved_voice}.wav")
-			await interaction.followup.send(
-				"",
-				file=audio_file,
-				ephemeral=False,
-			)
+				audio_file = discord.File(io.BytesIO(audio_bytes), filename=f"tts_{resolved_voice}.wav")
+				await interaction.followup.send(
+					"",
+					file=audio_file,
+					ephemeral=False,
+				)
 		except Exception as e:
 			await interaction.followup.send(
 				":x: Sorry, I encountered an error while generating the audio.",
 				ephemeral=False,
 			)
 			print(f"Error during TTS for voice '{resolved_voice}': {e}")
+			metrics.record_error("tts", e)
 			traceback.print_exc()
 
 	@tree.command(name="voice_clone", description="Speak text using a voice from an audio sample")
@@ -207,6 +315,12 @@ def setup_audio_commands(tree, config):
 		prompt: str,
 		ref_text: str = None,
 	):
+		if not await ratelimit.check_interaction(interaction, "voice_clone"):
+			return
+
+		config = settings.for_guild(interaction.guild_id)
+		inference_url = config.get("inference_url")
+
 		await interaction.response.defer(thinking=True)
 
 		# Validate audio file
@@ -218,36 +332,54 @@ def setup_audio_commands(tree, config):
 			return
 
 		try:
-			model = await _get_voice_clone_model(config)
-			loop = asyncio.get_event_loop()
-
-			# Download the audio file to a temporary location
-			with tempfile.NamedTemporaryFile(delete=False, suffix=Path(audio_sample.filename).suffix) as tmp_file:
-				await audio_sample.save(tmp_file.name)
-				temp_audio_path = tmp_file.name
-
-			try:
-				async with _tts_generation_lock:
-					audio_buffer = await loop.run_in_executor(
-						None,
-						lambda: _synthesize_voice_clone(
-							model,
+			with tracing.start_trace("voice_clone", user_id=interaction.user.id):
+				if inference_url:
+					with metrics.timed("voice_clone_remote"), tracing.span("voice_clone_remote"):
+						audio_buffer = await _remote_voice_clone(
+							inference_url,
 							prompt,
-							temp_audio_path,
+							await audio_sample.read(),
+							audio_sample.filename,
 							ref_text=ref_text,
-							language="Auto",
-						),
+						)
+					await interaction.followup.send(
+						"",
+						file=discord.File(audio_buffer, filename="voice_clone.wav"),
+						ephemeral=False,
 					)
-
-				audio_file = discord.File(audio_buffer, filename="voice_clone.wav")
-				await interaction.followup.send(
-					"",
-					file=audio_file,
-					ephemeral=False,
-				)
-			finally:
-				# Clean up temporary file
-				Path(temp_audio_path).unlink(missing_ok=True)
+					return
+
+				model = await _get_voice_clone_model(config)
+				loop = asyncio.get_event_loop()
+
+				# Download the audio file to a temporary location
+				with tempfile.NamedTemporaryFile(delete=False, suffix=Path(audio_sample.filename).suffix) as tmp_file:
+					await audio_sample.save(tmp_file.name)
+					temp_audio_path = tmp_file.name
+
+				try:
+					async with _tts_generation_lock:
+						with metrics.timed("voice_clone_generation"), tracing.span("voice_clone_generation"):
+							audio_buffer = await loop.run_in_executor(
+								None,
+								lambda: _synthesize_voice_clone(
+									model,
+									prompt,
+									temp_audio_path,
+									ref_text=ref_text,
+									language="Auto",
+								),
+							)
+
+					audio_file = discord.File(audio_buffer, filename="voice_clone.wav")
+					await interaction.followup.send(
+						"",
+						file=audio_file,
+						ephemeral=False,
+					)
+				finally:
+					# Clean up temporary file
+					Path(temp_audio_path).unlink(missing_ok=True)
 
 		except Exception as e:
 			await interaction.followup.send(
@@ -255,6 +387,7 @@ def setup_audio_commands(tree, config):
 				ephemeral=False,
 			)
 			print(f"Error during voice cloning: {e}")
+			metrics.record_error("voice_clone", e)
 			traceback.print_exc()
 
 	return tts, voice_clone
\ No newline at end of file
@@ -0,0 +1,241 @@
+import asyncio
+import datetime
+import hashlib
+import io
+import json
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import discord
+from discord import app_commands
+
+import metrics
+import ratelimit
+import settings
+import tracing
+from helpers import evict_least_recently_used, touch, write_file_atomic
+from icon import rendering, worker
+from singleflight import SingleFlight
+
+
+ICON_PATH = Path(__file__).resolve().parent / "icon" / "icon_outline.svg"
+
+# Month -> palette used by the "seasonal" theme
+SEASONAL_THEMES = {
+    1: "winter", 2: "winter", 3: "spring", 4: "spring", 5: "spring",
+    6: "summer", 7: "summer", 8: "summer", 9: "autumn", 10: "halloween",
+    11: "autumn", 12: "winter",
+}
+
+ICON_SIZES = (128, 256, 512, 1024, 2048, 4096)
+
+_memory_cache = OrderedDict()
+_memory_cache_bytes = 0
+_icon_cache_stats = {
+    "memory": 0,
+    "disk": 0,
+    "coalesced": 0,
+    "miss": 0,
+}
+
+
+def _resolve_theme(theme, today=None):
+    if theme == "seasonal":
+        return SEASONAL_THEMES[(today or datetime.date.today()).month]
+    return theme
+
+
+def _icon_dimensions(kind, size):
+    # Banners use Discord's 16:9 banner aspect ratio
+    if kind == "banner":
+        return size, size * 9 // 16
+    return size, size
+
+
+def _icon_cache_key(svg_digest, theme, colors, width, height, supersample):
+    key_source = json.dumps([svg_digest, theme, colors or [], width, height, supersample])
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+
+def _memory_cache_get(key):
+    png = _memory_cache.get(key)
+    if png is not None:
+        _memory_cache.move_to_end(key)
+    return png
+
+
+def _memory_cache_put(key, png, max_bytes):
+    global _memory_cache_bytes
+    if key in _memory_cache:
+        return
+    _memory_cache[key] = png
+    _memory_cache_bytes += len(png)
+    while _memory_cache_bytes > max_bytes and _memory_cache:
+        _, evicted = _memory_cache.popitem(last=False)
+        _memory_cache_bytes -= len(evicted)
+
+
+def _disk_cache_get(cache_dir, key):
+    path = Path(cache_dir) / f"{key}.png"
+    try:
+        png = path.read_bytes()
+    except OSError:
+        return None
+    touch(path)
+    return png
+
+
+def _disk_cache_put(cache_dir, key, png, max_bytes):
+    cache_path = Path(cache_dir)
+    cache_path.mkdir(parents=True, exist_ok=True)
+    write_file_atomic(cache_path / f"{key}.png", png)
+    evict_least_recently_used(cache_path, max_bytes, "*.png")
+
+
+def _record_icon_cache_lookup(result):
+    _icon_cache_stats[result] += 1
+    metrics.icon_cache_lookups.inc(result=result)
+
+
+def get_icon_cache_stats():
+    lookups = sum(_icon_cache_stats.values())
+    # A caller that waited on another caller's render didn't render either
+    hits = _icon_cache_stats["memory"] + _icon_cache_stats["disk"] + _icon_cache_stats["coalesced"]
+    return {
+        **_icon_cache_stats,
+        "hit_rate": hits / lookups if lookups else 0.0,
+    }
+
+
+def setup_icon_commands(tree, config):
+    svg_digest = hashlib.sha256(ICON_PATH.read_bytes()).hexdigest()
+    # Rendering is CPU bound numpy work, so it runs in worker processes. The
+    # pool is created on first use so bots that never render don't pay for it.
+    executor = None
+    render_flight = SingleFlight("icon")
+
+    def get_executor():
+        nonlocal executor
+        if executor is None:
+            executor = worker.create_executor(config.get("icon_render_workers", 2))
+        return executor
+
+    def discard_executor(broken):
+        nonlocal executor
+        if executor is broken:
+            executor = None
+            broken.shutdown(wait=False)
+
+    async def render(loop, *args):
+        # A worker that died (e.g. killed for memory) breaks the whole pool;
+        # replace it and retry once so one crash doesn't disable /icon
+        for attempt in range(2):
+            pool = get_executor()
+            try:
+                return await loop.run_in_executor(pool, rendering.render_png, *args)
+            except BrokenProcessPool:
+                print("Icon render pool broke, starting a new one")
+                discard_executor(pool)
+                if attempt:
+                    raise
+
+    async def get_icon_png(config, theme, width, height):
+        palettes = config.get("icon_palettes", {})
+        colors = palettes.get(theme)
+        supersample = config.get("icon_supersample", 2)
+        cache_dir = config.get("icon_cache_dir", "cache/icons")
+        key = _icon_cache_key(svg_digest, theme, colors, width, height, supersample)
+
+        png = _memory_cache_get(key)
+        if png is not None:
+            _record_icon_cache_lookup("memory")
+            return png
+
+        if render_flight.in_flight(key):
+            _record_icon_cache_lookup("coalesced")
+
+        return await render_flight.do(
+            key,
+            lambda: load_or_render(config, key, theme, colors, width, height, supersample, cache_dir),
+        )
+
+    async def load_or_render(config, key, theme, colors, width, height, supersample, cache_dir):
+        loop = asyncio.get_running_loop()
+        max_memory_bytes = config.get("icon_memory_cache_bytes", 64_000_000)
+
+        if cache_dir:
+            png = await loop.run_in_executor(None, lambda: _disk_cache_get(cache_dir, key))
+            if png is not None:
+                _record_icon_cache_lookup("disk")
+                _memory_cache_put(key, png, max_memory_bytes)
+                return png
+
+        _record_icon_cache_lookup("miss")
+        with metrics.timed("icon_render"), tracing.span("icon_render", theme=theme, width=width, height=height):
+            png = await render(loop, str(ICON_PATH), width, height, theme, colors, supersample)
+        _memory_cache_put(key, png, max_memory_bytes)
+
+        if cache_dir:
+            max_disk_bytes = config.get("icon_disk_cache_bytes", 512_000_000)
+            try:
+                await loop.run_in_executor(None, lambda: _disk_cache_put(cache_dir, key, png, max_disk_bytes))
+            except OSError as e:
+                print(f"Error writing icon cache entry: {e}")
+        return png
+
+    theme_choices = [app_commands.Choice(name="server default", value="default")]
+    theme_choices += [
+        app_commands.Choice(name=name, value=name)
+        for name in ["seasonal", *rendering.GRADIENTS]
+    ]
+
+    @tree.command(name="icon", description="Render the bot icon in a theme")
+    @app_commands.describe(
+        theme="Color theme (defaults to this server's theme)",
+        size="Width in pixels",
+        kind="Square avatar or 16:9 banner",
+    )
+    @app_commands.choices(
+        theme=theme_choices,
+        size=[app_commands.Choice(name=str(size), value=size) for size in ICON_SIZES],
+        kind=[
+            app_commands.Choice(name="avatar", value="avatar"),
+            app_commands.Choice(name="banner", value="banner"),
+        ],
+    )
+    async def icon(
+        interaction: discord.Interaction,
+        theme: str = "default",
+        size: int = 512,
+        kind: str = "avatar",
+    ):
+        if not await ratelimit.check_interaction(interaction, "icon"):
+            return
+
+        config = settings.for_guild(interaction.guild_id)
+        if theme == "default":
+            theme = config.get("icon_theme", "rainbow")
+        theme = _resolve_theme(theme)
+        if theme not in rendering.GRADIENTS and theme not in config.get("icon_palettes", {}):
+            await interaction.response.send_message(f":x: Unknown icon theme '{theme}'.", ephemeral=True)
+            return
+
+        await interaction.response.defer(thinking=True)
+        width, height = _icon_dimensions(kind, size)
+        try:
+            with metrics.timed("icon"), tracing.start_trace("icon", user_id=interaction.user.id, theme=theme):
+                png = await get_icon_png(config, theme, width, height)
+                await interaction.followup.send(
+                    "",
+                    file=discord.File(io.BytesIO(png), filename=f"{kind}_{theme}_{width}x{height}.png"),
+                    ephemeral=False,
+                )
+        except Exception as e:
+            await interaction.followup.send(
+                ":x: Sorry, I encountered an error while rendering the icon.",
+                ephemeral=False,
+            )
+            print(f"Error rendering icon '{theme}' at {width}x{height}: {e}")
+
+    return icon
@@ -1,11 +1,22 @@
 import asyncio
 import base64
+import hashlib
 import io
+import json
 import os
+import time
+from pathlib import Path
 import requests
 import discord
 from discord import app_commands
 
+import metrics
+import ratelimit
+import settings
+import tracing
+from helpers import evict_least_recently_used, get_inference_session, touch, write_file_atomic
+from singleflight import SingleFlight
+
 
 def _send_image_generation_request(chat_url, api_key, model, prompt, aspect_ratio=None):
     headers = {
@@ -57,46 +68,231 @@ def _data_url_to_bytes(data_url):
     return base64.b64decode(encoded)
 
 
+def _generate_image(chat_url, api_key, model, prompt, aspect_ratio=None):
+    response = _send_image_generation_request(
+        chat_url,
+        api_key,
+        model,
+        prompt,
+        aspect_ratio=aspect_ratio,
+    )
+    image_url, content = _parse_image_response(response)
+    if not image_url:
+        return None, content
+
+    return _data_url_to_bytes(image_url), content
+
+
+def _image_cache_key(model, aspect_ratio, prompt, variant=0):
+    key_source = json.dumps([model, aspect_ratio or "", prompt, variant])
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+
+def _image_cache_get(cache_dir, key, ttl):
+    image_path = Path(cache_dir) / f"{key}.png"
+    meta_path = Path(cache_dir) / f"{key}.json"
+    try:
+        if ttl and time.time() - image_path.stat().st_mtime > ttl:
+            image_path.unlink(missing_ok=True)
+            meta_path.unlink(missing_ok=True)
+            return None
+
+        image_bytes = image_path.read_bytes()
+        content = json.loads(meta_path.read_text(encoding="utf-8")).get("content", "")
+    except (OSError, ValueError):
+        return None
+
+    # The metadata file's modification time is the entry's last use; the
+    # image's stays the creation time for the TTL
+    touch(meta_path)
+    return image_bytes, content
+
+
+def _image_cache_put(cache_dir, key, image_bytes, content, max_bytes):
+    cache_path = Path(cache_dir)
+    cache_path.mkdir(parents=True, exist_ok=True)
+
+    write_file_atomic(cache_path / f"{key}.png", image_bytes)
+    write_file_atomic(cache_path / f"{key}.json", json.dumps({"content": content}).encode("utf-8"))
+
+    if max_bytes:
+        evict_least_recently_used(cache_path, max_bytes, "*.png", companion_suffixes=(".json",))
+
+
+def _record_image_cache_lookup(image_bytes):
+    if image_bytes is None:
+        metrics.image_cache_lookups.inc(result="miss")
+        return
+
+    metrics.image_cache_lookups.inc(result="hit")
+    metrics.image_cache_bytes_saved.inc(len(image_bytes))
+
+
+async def _remote_generate_image(inference_url, model, prompt, aspect_ratio=None):
+    async with get_inference_session().post(
+        f"{inference_url.rstrip('/')}/gen_image",
+        json={"model": model, "prompt": prompt, "aspect_ratio": aspect_ratio},
+    ) as response:
+        response.raise_for_status()
+        data = await response.json()
+
+    image = data.get("image")
+    return (base64.b64decode(image) if image else None), data.get("content", "")
+
+
 def setup_image_commands(tree, config):
-    chat_url = f"{config['server_url'].rstrip('/')}/chat/completions"
-    model = config.get("image_gen_model", "google/gemini-2.5-flash-image")
-    aspect_ratio = config.get("image_gen_aspect_ratio", "1:1")
+    # Registration-time values; changing these needs a restart
+    max_count = config.get("image_gen_max_count", 4)
+    # Bounds the number of generation requests in flight across all users
+    generation_semaphore = asyncio.Semaphore(config.get("image_gen_concurrency", 4))
+    # user id -> number of generation requests currently running for that user
+    active_per_user = {}
 
-    @tree.command(name="gen_image", description="Generate an image from a prompt")
-    @app_commands.describe(prompt="What you want the image to show")
-    async def gen_image(interaction: discord.Interaction, prompt: str):
-        await interaction.response.defer(thinking=True)
+    # Identical prompt and variant requests in flight share one generation
+    generation_flight = SingleFlight("gen_image")
+
+    async def generate_one(config, prompt, variant, refresh=False):
+        model = config.get("image_gen_model", "google/gemini-2.5-flash-image")
+        aspect_ratio = config.get("image_gen_aspect_ratio", "1:1")
+        return await generation_flight.do(
+            (_image_cache_key(model, aspect_ratio, prompt, variant), refresh),
+            lambda: _generate_one(config, prompt, variant, refresh),
+        )
+
+    async def _generate_one(config, prompt, variant, refresh=False):
+        chat_url = f"{config['server_url'].rstrip('/')}/chat/completions"
+        model = config.get("image_gen_model", "google/gemini-2.5-flash-image")
+        aspect_ratio = config.get("image_gen_aspect_ratio", "1:1")
+        cache_dir = config.get("image_cache_dir")
+        cache_max_bytes = config.get("image_cache_max_bytes", 500_000_000)
+        cache_ttl = config.get("image_cache_ttl", 7 * 24 * 3600)
+        # Optionally route generation through inference_server.py
+        inference_url = config.get("inference_url") if config.get("inference_gen_image") else None
 
         loop = asyncio.get_event_loop()
-        try:
-            response = await loop.run_in_executor(
-                None,
-                lambda: _send_image_generation_request(
-                    chat_url,
-                    os.getenv("HACKCLUB_AI_API_KEY"),
-                    model,
-                    prompt,
-                    aspect_ratio=aspect_ratio,
-                ),
-            )
-            image_url, content = _parse_image_response(response)
-            if not image_url:
-                await interaction.followup.send(
-                    ":x: Sorry, I couldn't generate an image for that prompt.",
-                    ephemeral=False,
+        cache_key = _image_cache_key(model, aspect_ratio, prompt, variant)
+
+        if cache_dir and not refresh:
+            with tracing.span("image_cache_lookup", variant=variant):
+                cached = await loop.run_in_executor(
+                    None,
+                    lambda: _image_cache_get(cache_dir, cache_key, cache_ttl),
                 )
-                return
+            _record_image_cache_lookup(cached[0] if cached else None)
+            if cached:
+                return cached
+
+        async with generation_semaphore:
+            with metrics.timed("image_generation"), tracing.span("image_generation", variant=variant):
+                if inference_url:
+                    image_bytes, content = await _remote_generate_image(inference_url, model, prompt, aspect_ratio)
+                else:
+                    image_bytes, content = await loop.run_in_executor(
+                        None,
+                        lambda: _generate_image(
+                            chat_url,
+                            os.getenv("HACKCLUB_AI_API_KEY"),
+                            model,
+                            prompt,
+                            aspect_ratio=aspect_ratio,
+                        ),
+                    )
+
+        if cache_dir and image_bytes is not None:
+            try:
+                await loop.run_in_executor(
+                    None,
+                    lambda: _image_cache_put(cache_dir, cache_key, image_bytes, content, cache_max_bytes),
+                )
+            except OSError as e:
+                print(f"Error writing image cache entry: {e}")
+
+        return image_bytes, content
+
+    @tree.command(name="gen_image", description="Generate an image from a prompt")
+    @app_commands.describe(
+        prompt="What you want the image to show",
+        count=f"How many variants to generate (1-{max_count})",
+        refresh="Generate new images instead of reusing cached ones",
+    )
+    async def gen_image(
+        interaction: discord.Interaction,
+        prompt: str,
+        count: app_commands.Range[int, 1, max_count] = 1,
+        refresh: bool = False,
+    ):
+        if not await ratelimit.check_interaction(interaction, "gen_image"):
+            return
+
+        config = settings.for_guild(interaction.guild_id)
+        max_per_user = config.get("image_gen_max_per_user", 4)
+        user_id = interaction.user.id
+        active = active_per_user.get(user_id, 0)
+        if count > max_per_user:
+            await interaction.response.send_message(
+                f":x: You can request at most {max_per_user} image(s) at once.",
+                ephemeral=True,
+            )
+            return
+        if active + count > max_per_user:
+            await interaction.response.send_message(
+                f":x: You already have {active} image(s) generating. Please wait for them to finish (limit {max_per_user}).",
+                ephemeral=True,
+            )
+            return
+
+        active_per_user[user_id] = active + count
+        try:
+            with metrics.timed("gen_image"), tracing.start_trace("gen_image", user_id=user_id, count=count):
+                await interaction.response.defer(thinking=True)
+
+                images = []
+                texts = []
+                failed = 0
+                # Collect results as they arrive so one slow variant doesn't hold up error handling for the rest
+                for future in asyncio.as_completed([generate_one(config, prompt, variant, refresh) for variant in range(count)]):
+                    try:
+                        image_bytes, content = await future
+                    except Exception as e:
+                        failed += 1
+                        print(f"Error during image generation for prompt '{prompt}':", e)
+                        continue
+
+                    if image_bytes is None:
+                        failed += 1
+                        continue
+
+                    images.append(image_bytes)
+                    if content:
+                        texts.append(content)
+
+                if not images:
+                    await interaction.followup.send(
+                        ":x: Sorry, I couldn't generate an image for that prompt.",
+                        ephemeral=False,
+                    )
+                    return
 
-            image_bytes = _data_url_to_bytes(image_url)
-            image_file = discord.File(io.BytesIO(image_bytes), filename="generated.png")
-            message_text = content or f"Prompt: {prompt}"
+                files = [
+                    discord.File(io.BytesIO(image_bytes), filename=f"generated_{idx + 1}.png")
+                    for idx, image_bytes in enumerate(images)
+                ]
+                message_text = texts[0] if texts and count == 1 else f"Prompt: {prompt}"
+                if failed:
+                    message_text += f"\n:warning: {failed} of {count} images failed to generate."
 
-            await interaction.followup.send(message_text, file=image_file, ephemeral=False)
+                await interaction.followup.send(message_text, files=files, ephemeral=False)
         except Exception as e:
             await interaction.followup.send(
                 ":x: Sorry, I encountered an error while generating the image.",
                 ephemeral=False,
             )
             print(f"Error during image generation for prompt '{prompt}':", e)
+        finally:
+            remaining = active_per_user.get(user_id, 0) - count
+            if remaining > 0:
+                active_per_user[user_id] = remaining
+            else:
+                active_per_user.pop(user_id, None)
 
     return gen_image
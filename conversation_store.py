@@ -0,0 +1,279 @@
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS messages ("
+    " message_id INTEGER PRIMARY KEY,"
+    " channel_id INTEGER NOT NULL,"
+    " guild_id INTEGER,"
+    " author_id INTEGER,"
+    " author_name TEXT NOT NULL,"
+    " content TEXT NOT NULL,"
+    " created_at REAL NOT NULL,"
+    " is_bot INTEGER NOT NULL DEFAULT 0)",
+    "CREATE INDEX IF NOT EXISTS messages_channel_time ON messages (channel_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS messages_time ON messages (created_at)",
+    "CREATE TABLE IF NOT EXISTS search_results ("
+    " message_id INTEGER PRIMARY KEY,"
+    " channel_id INTEGER NOT NULL,"
+    " created_at REAL NOT NULL,"
+    " results TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS search_results_time ON search_results (created_at)",
+)
+
+
+def _timestamp(created_at):
+    if created_at is None:
+        return time.time()
+    if hasattr(created_at, "timestamp"):
+        return created_at.timestamp()
+    return float(created_at)
+
+
+def message_row(message):
+    guild = getattr(message, "guild", None)
+    return (
+        message.id,
+        message.channel.id,
+        guild.id if guild else None,
+        message.author.id,
+        message.author.name,
+        message.content or "",
+        _timestamp(getattr(message, "created_at", None)),
+        1 if getattr(message.author, "bot", False) else 0,
+    )
+
+
+class ConversationStore:
+    """
+    Local record of channel messages, bot replies and the search results
+    used for them. Writes are buffered and flushed in batches on a single
+    background thread that owns the SQLite connection.
+    """
+
+    def __init__(
+        self,
+        path,
+        batch_size=100,
+        flush_interval=1.0,
+        max_age_days=30,
+        max_messages_per_channel=5000,
+        compact_interval=3600,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_age_days = max_age_days
+        self.max_messages_per_channel = max_messages_per_channel
+        self.compact_interval = compact_interval
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-store")
+        self._conn = None
+        self._pending = []
+        self._flush_event = None
+        self._tasks = []
+        # channel id -> how many messages were backfilled from Discord. Only
+        # channels seen since this process started are known to be complete.
+        self._covered_channels = {}
+        self._removal_callbacks = []
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+        return conn
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._flush_event = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._flush_loop()),
+            asyncio.create_task(self._compact_loop()),
+        ]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await self.flush()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+
+    def on_remove(self, callback):
+        """
+        Register callback(channel_id, message_ids) for messages that
+        compaction removes, so derived data can drop them too.
+        """
+        self._removal_callbacks.append(callback)
+
+    # Writes
+
+    def _enqueue(self, op):
+        self._pending.append(op)
+        if len(self._pending) >= self.batch_size and self._flush_event is not None:
+            self._flush_event.set()
+
+    def record_message(self, message):
+        self._enqueue(("upsert", message_row(message)))
+
+    def record_messages(self, messages):
+        for message in messages:
+            self.record_message(message)
+
+    def record_edit(self, message):
+        self._enqueue(("upsert", message_row(message)))
+
+    def record_delete(self, message_id):
+        self._enqueue(("delete", message_id))
+
+    def record_search_results(self, message_id, channel_id, results):
+        if results:
+            self._enqueue(("search", (message_id, channel_id, time.time(), results)))
+
+    def _write_batch(self, ops):
+        if self._conn is None:
+            self._conn = self._connect()
+        upserts = [row for kind, row in ops if kind == "upsert"]
+        searches = [row for kind, row in ops if kind == "search"]
+        deletes = [(row,) for kind, row in ops if kind == "delete"]
+        with self._conn:
+            if upserts:
+                self._conn.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)", upserts)
+            if searches:
+                self._conn.executemany("INSERT OR REPLACE INTO search_results VALUES (?, ?, ?, ?)", searches)
+            if deletes:
+                self._conn.executemany("DELETE FROM messages WHERE message_id = ?", deletes)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        ops, self._pending = self._pending, []
+        try:
+            await self._run(self._write_batch, ops)
+        except Exception as e:
+            print(f"Error writing {len(ops)} conversation store entries: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await self.flush()
+
+    # Reads
+
+    def is_covered(self, channel_id, limit):
+        backfilled = self._covered_channels.get(channel_id)
+        return backfilled is not None and backfilled >= limit
+
+    def mark_covered(self, channel_id, backfilled):
+        self._covered_channels[channel_id] = max(backfilled, self._covered_channels.get(channel_id, 0))
+
+    def _read_recent(self, channel_id, limit, exclude_message_id):
+        if self._conn is None:
+            self._conn = self._connect()
+        rows = self._conn.execute(
+            "SELECT message_id, author_name, content FROM messages"
+            " WHERE channel_id = ? AND message_id != ?"
+            " ORDER BY created_at DESC, message_id DESC LIMIT ?",
+            (channel_id, exclude_message_id or 0, limit),
+        ).fetchall()
+        rows.reverse()
+        return rows
+
+    async def recent_messages(self, channel_id, limit, exclude_message_id=None):
+        """
+        Return (message id, author name, content) rows in chronological order.
+        """
+        # Pending writes for this channel must be visible to the read
+        await self.flush()
+        return await self._run(self._read_recent, channel_id, limit, exclude_message_id)
+
+    def _read_messages_by_id(self, message_ids):
+        if self._conn is None:
+            self._conn = self._connect()
+        rows = []
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(message_ids), 500):
+            chunk = message_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(self._conn.execute(
+                "SELECT message_id, author_name, content FROM messages"
+                f" WHERE message_id IN ({placeholders}) ORDER BY created_at",
+                chunk,
+            ).fetchall())
+        return rows
+
+    async def messages_by_id(self, message_ids):
+        """
+        Return (message id, author name, content) rows for the given ids in chronological order.
+        """
+        await self.flush()
+        return await self._run(self._read_messages_by_id, list(message_ids))
+
+    # Retention
+
+    def _compact(self):
+        if self._conn is None:
+            self._conn = self._connect()
+        cutoff = time.time() - self.max_age_days * 86400
+        with self._conn:
+            deleted = self._conn.execute(
+                "SELECT channel_id, message_id FROM messages WHERE created_at < ?", (cutoff,)
+            ).fetchall()
+            self._conn.execute("DELETE FROM messages WHERE created_at < ?", (cutoff,))
+            self._conn.execute("DELETE FROM search_results WHERE created_at < ?", (cutoff,))
+            channels = self._conn.execute(
+                "SELECT channel_id FROM messages GROUP BY channel_id HAVING COUNT(*) > ?",
+                (self.max_messages_per_channel,),
+            ).fetchall()
+            for (channel_id,) in channels:
+                overflow = self._conn.execute(
+                    "SELECT message_id FROM messages WHERE channel_id = ?"
+                    " ORDER BY created_at DESC LIMIT -1 OFFSET ?",
+                    (channel_id, self.max_messages_per_channel),
+                ).fetchall()
+                self._conn.executemany("DELETE FROM messages WHERE message_id = ?", overflow)
+                deleted.extend((channel_id, message_id) for (message_id,) in overflow)
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._conn.execute("PRAGMA optimize")
+        return deleted
+
+    async def compact(self):
+        await self.flush()
+        deleted = await self._run(self._compact)
+        if deleted:
+            print(f"Conversation store compaction removed {len(deleted)} messages")
+            by_channel = {}
+            for channel_id, message_id in deleted:
+                by_channel.setdefault(channel_id, []).append(message_id)
+            for callback in self._removal_callbacks:
+                for channel_id, message_ids in by_channel.items():
+                    callback(channel_id, message_ids)
+        return len(deleted)
+
+    async def _compact_loop(self):
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            try:
+                await self.compact()
+            except Exception as e:
+                print(f"Error compacting conversation store: {e}")
@@ -0,0 +1,120 @@
+import contextvars
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+
+# Used until a stage has enough observations of its own
+DEFAULT_STAGE_SECONDS = {
+    "planner": 5.0,
+    "search": 2.0,
+    "main_model": 15.0,
+    "discord_send": 1.0,
+}
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class LatencyTracker:
+    """
+    Recent durations per stage. expected() is a high percentile of the
+    window, so budgets follow how slow upstreams currently are.
+    """
+
+    def __init__(self, window=200, percentile=90, min_samples=20, defaults=None):
+        self.window = window
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.defaults = {**DEFAULT_STAGE_SECONDS, **(defaults or {})}
+        self._samples = {}
+
+    def observe(self, stage, seconds):
+        samples = self._samples.get(stage)
+        if samples is None:
+            samples = deque(maxlen=self.window)
+            self._samples[stage] = samples
+        samples.append(seconds)
+
+    def expected(self, stage):
+        samples = self._samples.get(stage)
+        if samples is None or len(samples) < self.min_samples:
+            return self.defaults.get(stage, 0.0)
+        ordered = sorted(samples)
+        idx = min(len(ordered) - 1, round(self.percentile / 100 * (len(ordered) - 1)))
+        return ordered[idx]
+
+
+latency = LatencyTracker()
+
+
+def configure(percentile=90, window=200, defaults=None):
+    global latency
+    latency = LatencyTracker(window=window, percentile=percentile, defaults=defaults)
+
+
+@contextmanager
+def start(seconds):
+    """
+    Set a deadline for everything run inside the block, including tasks
+    created from it. A falsy value means no deadline.
+    """
+    token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """
+    Seconds left until the current deadline, or None without one.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def reserve(*stages):
+    return sum(latency.expected(stage) for stage in stages)
+
+
+def timeout_for(default, then=(), floor=1.0):
+    """
+    Timeout for a stage: the default, cut down so the stages in then still
+    have their expected time left. Never below floor, so a call always has
+    a chance to complete.
+    """
+    left = remaining()
+    if left is None:
+        return default
+    return max(floor, min(default, left - reserve(*then)))
+
+
+def can_run(stage, then=()):
+    """
+    Whether there's time for an optional stage and the stages after it.
+    A skip is counted in the stage skip metric.
+    """
+    left = remaining()
+    if left is None or left >= reserve(stage, *then):
+        return True
+    metrics.stage_skips.inc(stage=stage, reason="deadline")
+    return False
+
+
+def check(stage):
+    """
+    Raise DeadlineExceeded before starting a required stage once the
+    deadline has passed.
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        metrics.stage_skips.inc(stage=stage, reason="deadline")
+        raise DeadlineExceeded(f"deadline passed before {stage}")
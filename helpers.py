@@ -1,49 +1,220 @@
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import re
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import aiohttp
+import discord
 import requests
+from PIL import Image
+
+import metrics
+import shared_cache
+
+SEARCH_URL = "https://search.hackclub.com"
+INFERENCE_TIMEOUT = 600
+
+_inference_session = None
+DISCORD_MESSAGE_LIMIT = 2000
+
+# Split points in order of preference: paragraph, line, sentence, word
+_SPLIT_SEPARATORS = ("\n\n", "\n", ". ", "! ", "? ", " ")
+# A fence opens on a line of three or more backticks plus an optional
+# info string, and closes on a bare backtick run at least as long
+_FENCE_OPEN_RE = re.compile(r"(`{3,16})([^`]*)")
+_FENCE_CLOSE_RE = re.compile(r"(`{3,})[ \t]*")
+_MAX_FENCE_LANGUAGE = 32
+
+
+def _find_split(window):
+    # Only accept a separator in the back half of the window to avoid tiny chunks
+    min_pos = len(window) // 2
+    for separator in _SPLIT_SEPARATORS:
+        idx = window.rfind(separator, min_pos)
+        if idx != -1:
+            return idx + len(separator)
+    return len(window)
+
+
+def _update_fence(body, open_fence):
+    """
+    Track the code fence open after body. open_fence is the opening
+    backtick run plus its language, e.g. "```py", or None.
+    """
+    for line in body.split("\n"):
+        stripped = line.strip()
+        if open_fence:
+            match = _FENCE_CLOSE_RE.fullmatch(stripped)
+            if match and len(match.group(1)) >= _fence_length(open_fence):
+                open_fence = None
+        else:
+            match = _FENCE_OPEN_RE.fullmatch(stripped)
+            if match:
+                info = match.group(2).split()
+                open_fence = match.group(1) + (info[0][:_MAX_FENCE_LANGUAGE] if info else "")
+    return open_fence
+
+
+def _fence_length(open_fence):
+    return len(open_fence) - len(open_fence.lstrip("`"))
+
+
+def split_message(text, max_length=DISCORD_MESSAGE_LIMIT):
+    """
+    Split text into chunks of at most max_length characters in linear time.
+    Prefers paragraph and sentence boundaries, closes code fences at the end
+    of a chunk and reopens them (with the same language) in the next one.
+    """
+    chunks = []
+    pos = 0
+    length = len(text)
+    open_fence = None
+
+    while pos < length:
+        prefix = f"{open_fence}\n" if open_fence else ""
+        # Room for the closing fence; grows if the chunk opens a longer one
+        reserve = len("\n```")
+        while True:
+            if length - pos <= max_length - len(prefix):
+                end = length
+            else:
+                budget = max_length - len(prefix) - reserve
+                end = pos + _find_split(text[pos:pos + budget])
+
+            body = text[pos:end].rstrip("\n")
+            next_pos = end
+            while next_pos < length and text[next_pos] == "\n":
+                next_pos += 1
+
+            next_fence = _update_fence(body, open_fence)
+            close = "\n" + "`" * _fence_length(next_fence) if next_fence and next_pos < length else ""
+            if len(prefix) + len(body) + len(close) <= max_length or len(close) <= reserve:
+                break
+            reserve = len(close)
+
+        pos = next_pos
+        open_fence = next_fence
+        if not body.strip():
+            continue
 
-async def split_send(channel, message):
-    message_max_length = 2000
-    
-    messages = []
-    
-    while len(message) > message_max_length:
-        
-        snippet = message[0:message_max_length]
-        split_snippet = snippet.split("\n")
-        remaining = '\n'.join(split_snippet[0:-1]) if len(split_snippet) > 1 else snippet
-        return_snippet = ''.join(split_snippet[-1:]) if len(split_snippet) > 1 else ''
-
-        messages.append(remaining)
-        message = return_snippet + message[message_max_length:]
-        
-    messages.append(message)
-
-    for msg in messages:
-        if msg:
-            await channel.send(msg)
-
-
+        chunks.append(prefix + body + close)
+
+    return chunks
+
+
+def _file_kwargs(attachment):
+    # A failed upload consumes its file, so every attempt needs a fresh one
+    if attachment is None:
+        return {}
+    return {"files": [discord.File(io.BytesIO(attachment), filename="response.md")]}
+
+
+async def split_send(channel, message, reply_to=None, file_threshold=None):
+    """
+    Send a message of any length, replying to reply_to and chaining each
+    following chunk as a reply to the previous one. Messages longer than
+    file_threshold are sent as a preview with the full text attached.
+    Returns the sent messages.
+    """
+    if file_threshold and len(message) > file_threshold:
+        note = "\n\n*Response too long, full text attached.*"
+        chunks = split_message(message, DISCORD_MESSAGE_LIMIT - len(note))
+        attachment = message.encode("utf-8")
+        messages = [(chunks[0] + note, attachment)] if chunks else []
+    else:
+        messages = [(chunk, None) for chunk in split_message(message)]
+
+    sent_messages = []
+    target = reply_to
+    for text, attachment in messages:
+        sent = None
+        if target is not None:
+            try:
+                sent = await target.reply(text, mention_author=False, **_file_kwargs(attachment))
+            except discord.HTTPException:
+                # The message we reply to may have been deleted in the meantime
+                sent = None
+        if sent is None:
+            sent = await channel.send(text, **_file_kwargs(attachment))
+        sent_messages.append(sent)
+        target = sent
+
+    return sent_messages
+
+
+
+async def _fetch_recent_messages(channel, msg_context_length, exclude_message_id, store=None, index=None):
+    """
+    Return (message id, author name, content) rows in chronological order.
+    """
+    if store is not None and store.is_covered(channel.id, msg_context_length + 1):
+        return await store.recent_messages(channel.id, msg_context_length, exclude_message_id)
 
-async def fetch_context_messages(channel, msg_context_length, exclude_message_id):
     context_messages = []
+    history = []
     
     async for msg in channel.history(limit=msg_context_length + 1):
+        history.append(msg)
         if msg.id != exclude_message_id:
-            context_messages.insert(0, msg)
+            context_messages.insert(0, (msg.id, msg.author.name, msg.content))
+
+    if store is not None:
+        # Everything after this backfill arrives through on_message, so the store can serve this channel from now on
+        store.record_messages(history)
+        store.mark_covered(channel.id, msg_context_length + 1)
+    if index is not None:
+        for msg in history:
+            index.add_message(channel.id, msg.id, f"{msg.author.name}: {msg.content}")
+
+    return context_messages
+
+
+async def fetch_context_messages(channel, msg_context_length, exclude_message_id, store=None):
+    context_messages = await _fetch_recent_messages(channel, msg_context_length, exclude_message_id, store)
     
     # Build context string from messages
     context = ""
-    for msg in context_messages:
-        context += f"{msg.author.name}: {msg.content}\n"
+    for _, author_name, content in context_messages:
+        context += f"{author_name}: {content}\n"
     
     return context
 
 
+async def fetch_semantic_context(channel, question, recent_count, top_k, exclude_message_id, store, index):
+    """
+    Combine the last few messages with the older messages most similar to
+    the question. Needs the conversation store to look up message text.
+    """
+    recent = await _fetch_recent_messages(channel, recent_count, exclude_message_id, store, index)
+    # Snowflake ids grow with time, so only search messages older than the recent window
+    before_id = min([message_id for message_id, _, _ in recent] + [exclude_message_id])
+
+    matches = await index.search(channel.id, question, top_k=top_k, before_id=before_id)
+    relevant = await store.messages_by_id([message_id for message_id, _ in matches]) if matches else []
+
+    context = ""
+    if relevant:
+        context += "Relevant earlier messages:\n"
+        for _, author_name, content in relevant:
+            context += f"{author_name}: {content}\n"
+        context += "\nMost recent messages:\n"
+    for _, author_name, content in recent:
+        context += f"{author_name}: {content}\n"
+
+    return context
+
+
 
 
 def get_search_queries(web_response):
     lines = web_response.strip().split("\n")
     general_query = ""
     news_query = ""
+    image_query = ""
     
     for line in lines:
         if line.startswith("General Query:"):
@@ -63,15 +234,16 @@ def get_search_queries(web_response):
 
 
 
-def get_search_results(api_key, query, num_results=5, safesearch='off'):
+def get_search_results(api_key, query, num_results=5, safesearch='off', search_url=SEARCH_URL, timeout=10):
     if not query:
         return []
     
     try:
         response = requests.get(
-            'https://search.hackclub.com/res/v1/web/search',
+            f'{search_url}/res/v1/web/search',
             params={'q': query, 'count': num_results, 'safesearch': safesearch},
-            headers={'Authorization': f'Bearer {api_key}'}
+            headers={'Authorization': f'Bearer {api_key}'},
+            timeout=timeout,
         )
         response.raise_for_status()
         data = response.json()
@@ -87,18 +259,20 @@ def get_search_results(api_key, query, num_results=5, safesearch='off'):
         return results
     except Exception as e:
         print(f"Error fetching search results: {e}")
+        metrics.record_error("search_web", e)
         return []
     
 
-def get_news_results(api_key, query, num_results=5, safesearch='off'):
+def get_news_results(api_key, query, num_results=5, safesearch='off', search_url=SEARCH_URL, timeout=10):
     if not query:
         return []
     
     try:
         response = requests.get(
-            'https://search.hackclub.com/res/v1/news/search',
+            f'{search_url}/res/v1/news/search',
             params={'q': query, 'count': num_results, 'safesearch': safesearch},
-            headers={'Authorization': f'Bearer {api_key}'}
+            headers={'Authorization': f'Bearer {api_key}'},
+            timeout=timeout,
         )
         response.raise_for_status()
         data = response.json()
@@ -115,18 +289,20 @@ def get_news_results(api_key, query, num_results=5, safesearch='off'):
         return results
     except Exception as e:
         print(f"Error fetching news results: {e}")
+        metrics.record_error("search_news", e)
         return [] 
     
     
-def get_image_results(api_key, query, num_results=1, safesearch='off'):
+def get_image_results(api_key, query, num_results=1, safesearch='off', search_url=SEARCH_URL, timeout=10):
     if not query:
         return []
     
     try:
         response = requests.get(
-            'https://search.hackclub.com/res/v1/images/search',
+            f'{search_url}/res/v1/images/search',
             params={'q': query, 'count': num_results, 'safesearch': safesearch},
-            headers={'Authorization': f'Bearer {api_key}'}
+            headers={'Authorization': f'Bearer {api_key}'},
+            timeout=timeout,
         )
         response.raise_for_status()
         data = response.json()
@@ -141,6 +317,7 @@ def get_image_results(api_key, query, num_results=1, safesearch='off'):
         return results
     except Exception as e:
         print(f"Error fetching image results: {e}")
+        metrics.record_error("search_images", e)
         return []
 
 
@@ -230,7 +407,7 @@ def parse_chat_completions_text(data):
     return ""
 
 
-def send_responses_request(responses_url, api_key, model, messages):
+def send_responses_request(responses_url, api_key, model, messages, timeout=60):
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
@@ -239,12 +416,12 @@ def send_responses_request(responses_url, api_key, model, messages):
         "model": model,
         "input": messages,
     }
-    response = requests.post(responses_url, headers=headers, json=payload, timeout=60)
+    response = requests.post(responses_url, headers=headers, json=payload, timeout=timeout)
     response.raise_for_status()
     return response.json()
 
 
-def send_chat_completions_request(chat_url, api_key, model, messages):
+def send_chat_completions_request(chat_url, api_key, model, messages, timeout=60):
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
@@ -253,20 +430,19 @@ def send_chat_completions_request(chat_url, api_key, model, messages):
         "model": model,
         "messages": messages,
     }
-    response = requests.post(chat_url, headers=headers, json=payload, timeout=60)
+    response = requests.post(chat_url, headers=headers, json=payload, timeout=timeout)
     response.raise_for_status()
     return response.json()
 
 
 
-def get_image_urls_from_message(msg):
+def get_image_attachments_from_message(msg):
     if not msg:
         return []
 
-    urls = []
+    attachments = []
     for attachment in msg.attachments:
-        url = attachment.url
-        if not url:
+        if not attachment.url:
             continue
 
         content_type = (attachment.content_type or "").lower()
@@ -277,6 +453,253 @@ def get_image_urls_from_message(msg):
         )
 
         if is_image:
-            urls.append(url)
+            attachments.append(attachment)
+
+    return attachments
+
+
+def get_image_urls_from_message(msg):
+    return [attachment.url for attachment in get_image_attachments_from_message(msg)]
+
+
+_PROCESSED_IMAGE_CACHE_SIZE = 256
+
+# content hash -> downscaled data URL
+_processed_image_cache = shared_cache.Cache("processed_images", _PROCESSED_IMAGE_CACHE_SIZE)
+# attachment id -> content hash, so attachments seen before aren't downloaded again
+_attachment_hashes = shared_cache.Cache("attachment_hashes", 4 * _PROCESSED_IMAGE_CACHE_SIZE)
+
 
-    return urls
\ No newline at end of file
+def downscale_image_to_data_url(image_bytes, max_size):
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        # Animated images only keep their first frame
+        img.seek(0)
+        img = img.copy()
+
+    if max(img.size) > max_size:
+        img.thumbnail((max_size, max_size), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    if img.mode in ("RGBA", "LA", "P") and (img.mode != "P" or "transparency" in img.info):
+        img.convert("RGBA").save(buffer, format="PNG", optimize=True)
+        mime = "image/png"
+    else:
+        img.convert("RGB").save(buffer, format="JPEG", quality=85)
+        mime = "image/jpeg"
+
+    encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return f"data:{mime};base64,{encoded}"
+
+
+async def prepare_image_urls(attachments, max_size=1024):
+    """
+    Download, deduplicate and downscale image attachments into data URLs.
+    Falls back to the attachment URL if an image can't be processed.
+    """
+    urls = []
+    seen_hashes = set()
+    loop = asyncio.get_event_loop()
+
+    for attachment in attachments:
+        content_hash = await _attachment_hashes.aget(str(attachment.id))
+        image_bytes = None
+        data_url = await _processed_image_cache.aget(content_hash) if content_hash else None
+
+        if data_url is None:
+            try:
+                image_bytes = await attachment.read()
+            except Exception as e:
+                print(f"Error downloading image attachment: {e}")
+                metrics.record_error("image_download", e)
+                urls.append(attachment.url)
+                continue
+            if content_hash is None:
+                content_hash = hashlib.sha256(image_bytes).hexdigest()
+                await _attachment_hashes.aset(str(attachment.id), content_hash)
+                # Another attachment with the same content may have been processed already
+                if content_hash not in seen_hashes:
+                    data_url = await _processed_image_cache.aget(content_hash)
+
+        if content_hash in seen_hashes:
+            continue
+        seen_hashes.add(content_hash)
+
+        if data_url is None:
+            try:
+                data_url = await loop.run_in_executor(
+                    None,
+                    lambda: downscale_image_to_data_url(image_bytes, max_size),
+                )
+            except Exception as e:
+                print(f"Error preprocessing image attachment: {e}")
+                metrics.record_error("image_preprocess", e)
+                urls.append(attachment.url)
+                continue
+            await _processed_image_cache.aset(content_hash, data_url)
+
+        urls.append(data_url)
+
+    return urls
+
+
+
+# _caption_cache_key(url) -> short text description used by the planner
+_image_caption_cache = shared_cache.Cache("image_captions", 1024)
+
+IMAGE_CAPTION_PROMPT = "Describe this image in one or two short sentences. Mention any visible text."
+
+
+def _data_url_payload(url):
+    if not url.startswith("data:") or ";base64," not in url:
+        return None
+    return base64.b64decode(url.split(",", 1)[1])
+
+
+def data_url_payload_size(url):
+    """
+    Decoded size in bytes of a base64 data URL, or None for other URLs,
+    whose size isn't known without downloading them.
+    """
+    if not url.startswith("data:") or ";base64," not in url:
+        return None
+    encoded = url.split(",", 1)[1]
+    return len(encoded) * 3 // 4 - encoded[-2:].count("=")
+
+
+def _caption_cache_key(url):
+    if url.startswith("data:"):
+        # Data URLs are the image content itself
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+    # Attachment URLs carry an expiring signature in the query string; the
+    # path names the attachment, whose content never changes
+    parts = urlsplit(url)
+    return hashlib.sha256(f"{parts.netloc}{parts.path}".encode("utf-8")).hexdigest()
+
+
+def describe_image_locally(url):
+    image_bytes = _data_url_payload(url)
+    if image_bytes is None:
+        return "An image attachment."
+
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        width, height = img.size
+        image_format = img.format or "image"
+        # The average color of a tiny thumbnail is a cheap stand-in for the dominant color
+        r, g, b = img.convert("RGB").resize((1, 1), Image.BOX).getpixel((0, 0))
+
+    return f"A {width}x{height} {image_format} image with dominant color #{r:02x}{g:02x}{b:02x}."
+
+
+async def caption_images(image_urls, chat_url=None, api_key=None, model=None):
+    """
+    Return one text caption per image, computed once per image and cached.
+    Uses the given vision model if set, otherwise a cheap local description.
+    Returns the captions and the number of image bytes sent upstream, or
+    None for that if an image was sent by URL.
+    """
+    captions = []
+    bytes_sent = 0
+    loop = asyncio.get_event_loop()
+
+    for url in image_urls:
+        image_hash = _caption_cache_key(url)
+        caption = await _image_caption_cache.aget(image_hash)
+
+        if caption is None and model:
+            try:
+                response = await loop.run_in_executor(
+                    None,
+                    lambda: send_chat_completions_request(
+                        chat_url,
+                        api_key,
+                        model,
+                        [make_chat_message("user", IMAGE_CAPTION_PROMPT, image_urls=[url])],
+                    ),
+                )
+                caption = parse_chat_completions_text(response).strip() or None
+                payload_size = data_url_payload_size(url)
+                bytes_sent = None if bytes_sent is None or payload_size is None else bytes_sent + payload_size
+            except Exception as e:
+                print(f"Error captioning image: {e}")
+                metrics.record_error("image_caption", e)
+
+        if caption is None:
+            try:
+                caption = await loop.run_in_executor(None, lambda: describe_image_locally(url))
+            except Exception as e:
+                print(f"Error describing image: {e}")
+                caption = "An image attachment."
+            # Don't pin the local fallback if the caption model just failed transiently
+            if not model:
+                await _image_caption_cache.aset(image_hash, caption)
+        else:
+            await _image_caption_cache.aset(image_hash, caption)
+
+        captions.append(caption)
+
+    return captions, bytes_sent
+
+
+
+def write_file_atomic(path, data):
+    """
+    Write bytes to path through a temp file, so readers never see a
+    partial file.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def touch(path):
+    """
+    Mark a cache file as used. Access times aren't reliable on every
+    filesystem, so disk caches order eviction by modification time. A file
+    evicted in the meantime is ignored.
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def evict_least_recently_used(directory, max_bytes, pattern="*", companion_suffixes=()):
+    """
+    Delete the least recently used files matching pattern in directory
+    until their total size fits in max_bytes. Companion files (same name,
+    other suffix) count toward their entry's size and last use, and are
+    deleted with it.
+    """
+    entries = []
+    total = 0
+    for path in Path(directory).glob(pattern):
+        paths = [path] + [path.with_suffix(suffix) for suffix in companion_suffixes]
+        try:
+            stats = [p.stat() for p in paths]
+        except OSError:
+            continue
+        size = sum(stat.st_size for stat in stats)
+        entries.append((max(stat.st_mtime for stat in stats), size, paths))
+        total += size
+
+    entries.sort(key=lambda entry: entry[0])
+    for _, size, paths in entries:
+        if total <= max_bytes:
+            break
+        for p in paths:
+            try:
+                p.unlink(missing_ok=True)
+            except OSError:
+                pass
+        total -= size
+
+
+def get_inference_session():
+    """
+    Shared aiohttp session for calls to inference_server.py.
+    """
+    global _inference_session
+    if _inference_session is None or _inference_session.closed:
+        _inference_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=INFERENCE_TIMEOUT))
+    return _inference_session
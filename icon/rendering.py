@@ -0,0 +1,337 @@
+"""
+Shared icon rendering for render.py, render_monochrome.py and the bot.
+
+Paths are sampled once per SVG (lines by their endpoints, Bezier curves
+with vectorized Bernstein evaluation) and every subpath is rasterized in a
+single even-odd scanline pass. Masks are cached by SVG content and size.
+"""
+import hashlib
+import io
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from functools import partial
+from math import comb
+
+import numpy as np
+from PIL import Image
+from svgpathtools import CubicBezier, Line, QuadraticBezier, parse_path
+
+
+DISCORD_AVATAR_SIZES = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+_SVG_NS = {"svg": "http://www.w3.org/2000/svg"}
+
+# Geometry is small; masks are bounded by their total size in bytes
+_GEOMETRY_CACHE_SIZE = 16
+_MASK_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+_geometry_cache = OrderedDict()
+_mask_cache = OrderedDict()
+_mask_cache_bytes = 0
+
+
+def create_rainbow_gradient_image(width=1024, height=1024):
+    """
+    Fast vertical HSV rainbow gradient from top to bottom.
+    """
+    # Hue only varies vertically, so convert one column and repeat it
+    hue = np.linspace(0.0, 1.0, height, endpoint=False)
+
+    sat = np.ones_like(hue)
+    val = np.ones_like(hue)
+
+    # HSV to RGB (vectorized)
+    i = np.floor(hue * 6).astype(int)
+    f = hue * 6 - i
+    p = val * (1 - sat)
+    q = val * (1 - f * sat)
+    t = val * (1 - (1 - f) * sat)
+
+    i = i % 6
+
+    r = np.choose(i, [val, q, p, p, t, val])
+    g = np.choose(i, [t, val, val, q, p, p])
+    b = np.choose(i, [p, p, t, val, val, q])
+
+    column = (np.stack([r, g, b], axis=1) * 255).astype(np.uint8)
+    img = np.ascontiguousarray(np.broadcast_to(column[:, np.newaxis, :], (height, width, 3)))
+
+    return Image.fromarray(img, mode="RGB")
+
+
+def create_monochrome_image(width=1024, height=1024):
+    """
+    Solid black fill.
+    """
+    return Image.new("RGB", (width, height), (0, 0, 0))
+
+
+def _hex_to_rgb(color):
+    color = color.lstrip("#")
+    if len(color) != 6:
+        raise ValueError(f"Expected a #rrggbb color, got '{color}'")
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def create_palette_gradient_image(width=1024, height=1024, colors=("#000000", "#ffffff")):
+    """
+    Vertical gradient through evenly spaced color stops, top to bottom.
+    """
+    stops = np.array([_hex_to_rgb(color) for color in colors], dtype=np.float64)
+    if len(stops) == 1:
+        stops = np.repeat(stops, 2, axis=0)
+    positions = np.linspace(0.0, 1.0, len(stops))
+    y = np.linspace(0.0, 1.0, height)
+    column = np.stack([np.interp(y, positions, stops[:, channel]) for channel in range(3)], axis=1)
+    column = np.round(column).astype(np.uint8)
+    img = np.ascontiguousarray(np.broadcast_to(column[:, np.newaxis, :], (height, width, 3)))
+    return Image.fromarray(img, mode="RGB")
+
+
+PALETTES = {
+    "sunset": ("#ff5f6d", "#ffc371"),
+    "ocean": ("#0f2027", "#2193b0", "#6dd5ed"),
+    "forest": ("#134e5e", "#71b280"),
+    "autumn": ("#8e0e00", "#e65c00", "#f9d423"),
+    "halloween": ("#ff7518", "#2b0a3d"),
+    "winter": ("#e0eafc", "#4a6fa5"),
+    "spring": ("#a8e063", "#f9d423"),
+    "summer": ("#f7971e", "#ffd200", "#00c6ff"),
+}
+
+GRADIENTS = {
+    "rainbow": create_rainbow_gradient_image,
+    "monochrome": create_monochrome_image,
+    **{name: partial(create_palette_gradient_image, colors=colors) for name, colors in PALETTES.items()},
+}
+
+
+def _bezier_points(bpoints, ts):
+    degree = len(bpoints) - 1
+    t = ts[:, np.newaxis]
+    i = np.arange(degree + 1)
+    binomials = np.array([comb(degree, k) for k in i], dtype=np.float64)
+    basis = binomials * (1 - t) ** (degree - i) * t ** i
+    return basis @ np.asarray(bpoints, dtype=np.complex128)
+
+
+def _sample_subpath(subpath, curve_steps):
+    ts = np.linspace(0, 1, curve_steps, endpoint=False)
+    chunks = []
+    line_starts = []
+    for segment in subpath:
+        if isinstance(segment, Line):
+            # Samples along a line are collinear, so its start point is enough
+            line_starts.append(segment.start)
+            continue
+        if line_starts:
+            chunks.append(np.array(line_starts, dtype=np.complex128))
+            line_starts = []
+        if isinstance(segment, (QuadraticBezier, CubicBezier)):
+            chunks.append(_bezier_points(segment.bpoints(), ts))
+        else:
+            # Arcs have no polynomial form
+            chunks.append(np.array([segment.point(t) for t in ts], dtype=np.complex128))
+    line_starts.append(subpath[-1].end)
+    chunks.append(np.array(line_starts, dtype=np.complex128))
+    return np.concatenate(chunks)
+
+
+def _load_geometry(svg_bytes, digest, curve_steps):
+    """
+    Return (viewbox, list of complex point arrays), one per subpath, in
+    viewBox coordinates.
+    """
+    key = (digest, curve_steps)
+    cached = _geometry_cache.get(key)
+    if cached is not None:
+        _geometry_cache.move_to_end(key)
+        return cached
+
+    root = ET.fromstring(svg_bytes)
+    viewbox = tuple(map(float, root.get("viewBox", "0 0 100 100").split()))
+    polygons = []
+    for path_elem in root.findall(".//svg:path", _SVG_NS):
+        d = path_elem.get("d")
+        if not d:
+            continue
+        for subpath in parse_path(d).continuous_subpaths():
+            points = _sample_subpath(subpath, curve_steps)
+            if len(points) >= 3:
+                polygons.append(points)
+
+    geometry = (viewbox, polygons)
+    _geometry_cache[key] = geometry
+    while len(_geometry_cache) > _GEOMETRY_CACHE_SIZE:
+        _geometry_cache.popitem(last=False)
+    return geometry
+
+
+def rasterize_even_odd(polygons, width, height):
+    """
+    Fill closed polygons (complex point arrays in pixel coordinates) with
+    the even-odd rule, sampling at pixel centers. Returns a uint8 array of
+    0 and 1.
+
+    Every edge contributes one crossing per scanline it spans. Toggling a
+    pixel at each crossing and XOR-accumulating along the row gives the
+    parity of crossings to the left of each pixel center.
+    """
+    if not polygons:
+        return np.zeros((height, width), dtype=np.uint8)
+
+    starts = np.concatenate(polygons)
+    ends = np.concatenate([np.roll(points, -1) for points in polygons])
+    x0, y0 = starts.real, starts.imag
+    x1, y1 = ends.real, ends.imag
+
+    sloped = y0 != y1
+    x0, y0, x1, y1 = x0[sloped], y0[sloped], x1[sloped], y1[sloped]
+
+    # Rows whose center r + 0.5 lies in [min(y), max(y))
+    row_start = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, height).astype(np.int64)
+    row_end = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, height).astype(np.int64)
+    counts = np.maximum(row_end - row_start, 0)
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros((height, width), dtype=np.uint8)
+
+    edge = np.repeat(np.arange(counts.size), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    rows = row_start[edge] + offsets
+
+    t = (rows + 0.5 - y0[edge]) / (y1[edge] - y0[edge])
+    crossing_x = x0[edge] + t * (x1[edge] - x0[edge])
+    # First pixel whose center lies right of the crossing
+    cols = np.clip(np.ceil(crossing_x - 0.5), 0, width).astype(np.int64)
+
+    toggles = np.zeros((height, width + 1), dtype=np.uint8)
+    np.bitwise_xor.at(toggles, (rows, cols), 1)
+    return np.bitwise_xor.accumulate(toggles, axis=1)[:, :width]
+
+
+def _render_mask_array(svg_bytes, digest, width, height, curve_steps, supersample):
+    viewbox, polygons = _load_geometry(svg_bytes, digest, curve_steps)
+    vb_x, vb_y, vb_w, vb_h = viewbox
+
+    raster_w, raster_h = width * supersample, height * supersample
+    # Uniform scale to preserve aspect ratio, content centered in the output
+    scale = min(raster_w, raster_h) / max(vb_w, vb_h)
+    transformed = [(points - complex(vb_x, vb_y)) * scale for points in polygons]
+    if transformed:
+        all_points = np.concatenate(transformed)
+        center = complex(
+            (all_points.real.min() + all_points.real.max()) / 2,
+            (all_points.imag.min() + all_points.imag.max()) / 2,
+        )
+        shift = complex(raster_w / 2, raster_h / 2) - center
+        transformed = [points + shift for points in transformed]
+
+    mask = rasterize_even_odd(transformed, raster_w, raster_h)
+    if supersample > 1:
+        # Box-filter coverage down to the output size for anti-aliased edges
+        coverage = mask.reshape(height, supersample, width, supersample).mean(axis=(1, 3))
+        return np.round(coverage * 255).astype(np.uint8)
+    return mask * np.uint8(255)
+
+
+def _read_svg(icon_path):
+    with open(icon_path, "rb") as f:
+        svg_bytes = f.read()
+    return svg_bytes, hashlib.sha256(svg_bytes).hexdigest()
+
+
+def _cached_mask(svg_bytes, digest, width, height, curve_steps, supersample):
+    global _mask_cache_bytes
+    key = (digest, width, height, curve_steps, supersample)
+    mask = _mask_cache.get(key)
+    if mask is not None:
+        _mask_cache.move_to_end(key)
+        return mask
+
+    mask = _render_mask_array(svg_bytes, digest, width, height, curve_steps, supersample)
+    mask.setflags(write=False)
+    _mask_cache[key] = mask
+    _mask_cache_bytes += mask.nbytes
+    while _mask_cache_bytes > _MASK_CACHE_MAX_BYTES and len(_mask_cache) > 1:
+        _, evicted = _mask_cache.popitem(last=False)
+        _mask_cache_bytes -= evicted.nbytes
+    return mask
+
+
+def clear_cache():
+    global _mask_cache_bytes
+    _geometry_cache.clear()
+    _mask_cache.clear()
+    _mask_cache_bytes = 0
+
+
+def get_icon_mask(icon_path, width=1024, height=1024, curve_steps=20, supersample=1):
+    """
+    Rasterize SVG paths into an "L" mask with the content centered in the
+    output. supersample > 1 anti-aliases the edges.
+    """
+    svg_bytes, digest = _read_svg(icon_path)
+    mask = _cached_mask(svg_bytes, digest, width, height, curve_steps, supersample)
+    return Image.fromarray(mask, mode="L")
+
+
+def apply_mask(gradient_img, mask_img):
+    """
+    Apply mask as alpha channel.
+    """
+    result = gradient_img.convert("RGBA")
+    result.putalpha(mask_img)
+    return result
+
+
+def render_icon(icon_path, width=1024, height=1024, variant="rainbow", curve_steps=20, supersample=1):
+    images = render_icons(icon_path, [(width, height)], [variant], curve_steps=curve_steps, supersample=supersample)
+    return images[(variant, (width, height))]
+
+
+def render_icons(
+    icon_path,
+    sizes=DISCORD_AVATAR_SIZES,
+    variants=("rainbow",),
+    curve_steps=20,
+    supersample=1,
+    gradients=None,
+):
+    """
+    Render every variant at every size, reading and sampling the SVG once.
+    Sizes are ints for square images or (width, height) pairs. Returns a
+    dict mapping (variant, (width, height)) to an RGBA image.
+
+    gradients maps extra variant names to fill functions taking
+    (width, height), in addition to GRADIENTS.
+    """
+    fills = {**GRADIENTS, **(gradients or {})}
+    unknown = [variant for variant in variants if variant not in fills]
+    if unknown:
+        raise ValueError(f"Unknown icon variant(s): {', '.join(unknown)}")
+
+    svg_bytes, digest = _read_svg(icon_path)
+    results = {}
+    for size in sizes:
+        width, height = (size, size) if isinstance(size, int) else size
+        mask = Image.fromarray(
+            _cached_mask(svg_bytes, digest, width, height, curve_steps, supersample),
+            mode="L",
+        )
+        for variant in variants:
+            results[(variant, (width, height))] = apply_mask(fills[variant](width, height), mask)
+    return results
+
+
+def render_png(icon_path, width, height, variant="rainbow", colors=None, supersample=1):
+    """
+    Render one image and return it PNG-encoded. With colors, variant is
+    only a label and the fill is a gradient through those colors. Meant
+    to run in a worker process, so arguments and result are picklable.
+    """
+    gradients = {variant: partial(create_palette_gradient_image, colors=colors)} if colors else None
+    image = render_icons(icon_path, [(width, height)], [variant], supersample=supersample, gradients=gradients)
+    buffer = io.BytesIO()
+    image[(variant, (width, height))].save(buffer, format="PNG", optimize=False)
+    return buffer.getvalue()
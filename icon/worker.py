@@ -0,0 +1,44 @@
+"""
+Worker processes for rendering icons from the bot.
+
+A spawned process first re-runs its parent's main module, which for the bot
+is main.py with all of its setup (config, SQLite stores, the Discord
+client). Workers from create_executor() run this module as their main
+module instead, so they only import icon.rendering.
+"""
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.context import SpawnContext, SpawnProcess
+
+from icon import rendering  # noqa: F401 - loaded once per worker before the first task
+
+
+# Processes read the main module while starting; this keeps two threads
+# starting workers from restoring each other's swap out of order
+_start_lock = threading.Lock()
+
+
+class _WorkerProcess(SpawnProcess):
+    @staticmethod
+    def _Popen(process_obj):
+        entry = types.ModuleType("__main__")
+        entry.__file__ = __file__
+        with _start_lock:
+            parent_main = sys.modules["__main__"]
+            sys.modules["__main__"] = entry
+            try:
+                return SpawnProcess._Popen(process_obj)
+            finally:
+                sys.modules["__main__"] = parent_main
+
+
+class _WorkerContext(SpawnContext):
+    # Spawned rather than forked: a fork would copy the running event loop,
+    # open SQLite connections and locks held by other threads
+    Process = _WorkerProcess
+
+
+def create_executor(max_workers):
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=_WorkerContext())
@@ -0,0 +1,231 @@
+"""
+Local inference service for the heavy commands, so gateway processes don't
+need to load the TTS models. Point the bot at it with "inference_url" in
+config.json.
+
+Usage: python inference_server.py [--host 127.0.0.1] [--port 8800]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+import metrics
+from c_audio import (
+    _get_tts_model,
+    _get_voice_clone_model,
+    _resolve_voice,
+    _synthesize_voice_clone,
+    _synthesize_wav_batch,
+    _tts_generation_lock,
+)
+from c_images import _generate_image
+
+
+class _TTSRequest:
+    __slots__ = ("text", "voice", "future")
+
+    def __init__(self, text, voice, future):
+        self.text = text
+        self.voice = voice
+        self.future = future
+
+
+async def _collect_batch(queue, max_batch, window):
+    """
+    Wait for one request, then keep collecting for up to window seconds
+    or until the batch is full.
+    """
+    loop = asyncio.get_running_loop()
+    batch = [await queue.get()]
+    deadline = loop.time() + window
+    while len(batch) < max_batch:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+
+async def _tts_worker(app):
+    config = app["config"]
+    queue = app["tts_queue"]
+    max_batch = config.get("inference_batch_size", 8)
+    window = config.get("inference_batch_window_ms", 50) / 1000
+    loop = asyncio.get_running_loop()
+
+    while True:
+        batch = await _collect_batch(queue, max_batch, window)
+        # Requests whose caller already gave up don't need synthesizing
+        batch = [request for request in batch if not request.future.done()]
+        if not batch:
+            continue
+
+        metrics.tts_batch_size.observe(len(batch))
+        try:
+            model = await _get_tts_model(config)
+            async with _tts_generation_lock:
+                with metrics.timed("tts_generation"):
+                    buffers = await loop.run_in_executor(
+                        None,
+                        lambda: _synthesize_wav_batch(
+                            model,
+                            [request.text for request in batch],
+                            [request.voice for request in batch],
+                        ),
+                    )
+            for request, buffer in zip(batch, buffers):
+                if not request.future.done():
+                    request.future.set_result(buffer.getvalue())
+        except Exception as e:
+            print(f"Error during batched TTS ({len(batch)} requests): {e}")
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+
+
+async def handle_tts(request):
+    data = await request.json()
+    voice = _resolve_voice(data.get("voice"))
+    text = data.get("text", "")
+    if not voice or not text:
+        raise web.HTTPBadRequest(text="A supported voice and non-empty text are required")
+
+    future = asyncio.get_running_loop().create_future()
+    try:
+        request.app["tts_queue"].put_nowait(_TTSRequest(text, voice, future))
+    except asyncio.QueueFull:
+        metrics.errors.inc(stage="tts_queue", type="QueueFull", status=503)
+        raise web.HTTPServiceUnavailable(text="TTS queue is full, try again later")
+
+    try:
+        audio = await future
+    except Exception as e:
+        raise web.HTTPInternalServerError(text=f"TTS failed: {e}")
+    return web.Response(body=audio, content_type="audio/wav")
+
+
+async def handle_voice_clone(request):
+    config = request.app["config"]
+    reader = await request.multipart()
+    fields = {}
+    audio_bytes = None
+    suffix = ".wav"
+    async for part in reader:
+        if part.name == "audio":
+            suffix = Path(part.filename or "sample.wav").suffix or ".wav"
+            audio_bytes = await part.read()
+        else:
+            fields[part.name] = await part.text()
+
+    if not audio_bytes or not fields.get("text"):
+        raise web.HTTPBadRequest(text="An audio sample and non-empty text are required")
+
+    loop = asyncio.get_running_loop()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        tmp_file.write(audio_bytes)
+        temp_audio_path = tmp_file.name
+
+    try:
+        model = await _get_voice_clone_model(config)
+        async with _tts_generation_lock:
+            with metrics.timed("voice_clone_generation"):
+                buffer = await loop.run_in_executor(
+                    None,
+                    lambda: _synthesize_voice_clone(
+                        model,
+                        fields["text"],
+                        temp_audio_path,
+                        ref_text=fields.get("ref_text"),
+                        language="Auto",
+                    ),
+                )
+    except Exception as e:
+        print(f"Error during voice cloning: {e}")
+        raise web.HTTPInternalServerError(text=f"Voice cloning failed: {e}")
+    finally:
+        Path(temp_audio_path).unlink(missing_ok=True)
+
+    return web.Response(body=buffer.getvalue(), content_type="audio/wav")
+
+
+async def handle_gen_image(request):
+    config = request.app["config"]
+    data = await request.json()
+    if not data.get("prompt"):
+        raise web.HTTPBadRequest(text="A prompt is required")
+
+    chat_url = f"{config['server_url'].rstrip('/')}/chat/completions"
+    loop = asyncio.get_running_loop()
+    async with request.app["image_semaphore"]:
+        try:
+            with metrics.timed("image_generation"):
+                image_bytes, content = await loop.run_in_executor(
+                    None,
+                    lambda: _generate_image(
+                        chat_url,
+                        os.getenv("HACKCLUB_AI_API_KEY"),
+                        data.get("model") or config.get("image_gen_model", "google/gemini-2.5-flash-image"),
+                        data["prompt"],
+                        aspect_ratio=data.get("aspect_ratio"),
+                    ),
+                )
+        except Exception as e:
+            print(f"Error during image generation: {e}")
+            raise web.HTTPBadGateway(text=f"Image generation failed: {e}")
+
+    return web.json_response({
+        "image": base64.b64encode(image_bytes).decode("ascii") if image_bytes else None,
+        "content": content,
+    })
+
+
+async def handle_metrics(request):
+    return web.Response(text=metrics.render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+async def _start_workers(app):
+    app["tts_queue"] = asyncio.Queue(maxsize=app["config"].get("inference_queue_size", 64))
+    app["image_semaphore"] = asyncio.Semaphore(app["config"].get("image_gen_concurrency", 4))
+    app["tts_worker"] = asyncio.create_task(_tts_worker(app))
+    if app["config"].get("tts_warmup", False):
+        # Load the model before the first request arrives
+        asyncio.create_task(_get_tts_model(app["config"]))
+
+
+async def _stop_workers(app):
+    app["tts_worker"].cancel()
+
+
+def make_app(config):
+    app = web.Application(client_max_size=50 * 1024 * 1024)
+    app["config"] = config
+    app.router.add_post("/tts", handle_tts)
+    app.router.add_post("/voice_clone", handle_voice_clone)
+    app.router.add_post("/gen_image", handle_gen_image)
+    app.router.add_get("/metrics", handle_metrics)
+    app.on_startup.append(_start_workers)
+    app.on_cleanup.append(_stop_workers)
+    return app
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    with open("config.json", "r") as f:
+        config = json.load(f)
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=config.get("inference_host", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=config.get("inference_port", 8800))
+    args = parser.parse_args()
+
+    web.run_app(make_app(config), host=args.host, port=args.port)
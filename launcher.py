@@ -0,0 +1,105 @@
+"""
+Run the bot as several processes, each owning a subset of the shards.
+
+Usage:
+    python launcher.py --shards 4 --processes 2
+    python launcher.py --shards 4 --processes 2 --fake-gateway
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent
+
+
+def assign_shards(shard_count, process_count):
+    # Round-robin keeps the shard count per process within one of each other
+    assignments = [[] for _ in range(process_count)]
+    for shard_id in range(shard_count):
+        assignments[shard_id % process_count].append(shard_id)
+    return [shard_ids for shard_ids in assignments if shard_ids]
+
+
+def build_env(shard_count, shard_ids, process_index, metrics_port):
+    env = dict(os.environ)
+    env["SHARD_COUNT"] = str(shard_count)
+    env["SHARD_IDS"] = ",".join(str(shard_id) for shard_id in shard_ids)
+    if metrics_port:
+        # Each process serves its own /metrics on consecutive ports
+        env["METRICS_PORT"] = str(int(metrics_port) + process_index)
+    return env
+
+
+def spawn(command, env):
+    return subprocess.Popen(command, env=env, cwd=ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, required=True, help="Total number of shards")
+    parser.add_argument("--processes", type=int, default=None, help="Number of processes (default: one per shard)")
+    parser.add_argument("--fake-gateway", action="store_true",
+                        help="Drive each process with synthetic messages instead of connecting to Discord")
+    parser.add_argument("--restart-delay", type=float, default=5.0, help="Seconds to wait before restarting a crashed process")
+    args, extra = parser.parse_known_args()
+
+    with open(ROOT / "config.json", "r") as f:
+        config = json.load(f)
+
+    if args.fake_gateway:
+        command = [sys.executable, str(ROOT / "benchmarks" / "fake_gateway.py"), *extra]
+    else:
+        command = [sys.executable, str(ROOT / "main.py")]
+
+    assignments = assign_shards(args.shards, args.processes or args.shards)
+    envs = [
+        build_env(args.shards, shard_ids, idx, config.get("metrics_port"))
+        for idx, shard_ids in enumerate(assignments)
+    ]
+    processes = [spawn(command, env) for env in envs]
+    for shard_ids, process in zip(assignments, processes):
+        print(f"Started process {process.pid} for shards {shard_ids}")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while not stopping:
+        for idx, process in enumerate(processes):
+            code = process.poll()
+            if code is None:
+                continue
+            if args.fake_gateway:
+                # Fake gateway runs are finite, so exiting is expected
+                continue
+            print(f"Process for shards {assignments[idx]} exited with {code}, restarting in {args.restart_delay}s")
+            time.sleep(args.restart_delay)
+            if stopping:
+                # Stopped during the delay; stop() only saw the exited process
+                break
+            processes[idx] = spawn(command, envs[idx])
+
+        if args.fake_gateway and all(process.poll() is not None for process in processes):
+            break
+        time.sleep(0.5)
+
+    for process in processes:
+        process.wait()
+
+
+if __name__ == "__main__":
+    main()
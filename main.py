@@ -1,21 +1,109 @@
+import time
+_process_start = time.perf_counter()
+
 import discord
 from discord import app_commands
 from dotenv import load_dotenv
 import os
-import json
 import asyncio
 from helpers import *
+import deadline
+import metrics
+import ratelimit
+import settings
+from singleflight import SingleFlight, make_key, normalize_text
+import shared_cache
+import tracing
+from conversation_store import ConversationStore
+from semantic_index import SemanticIndex
+from pipeline import build_messages, chat_completions_url, generate_response
+from replay_log import ReplayLog, strip_data_urls
 from c_images import setup_image_commands
-from c_audio import setup_audio_commands
+from c_audio import setup_audio_commands, warm_up_audio
 load_dotenv()
 
+IMPORT_SECONDS = time.perf_counter() - _process_start
+
+
+# Startup-only values are read from this first version; request handling
+# goes through settings.for_guild() so edits to config.json apply live
+config = settings.load("config.json")
+
+
+tracing.configure(
+    sample_rate=config.get("trace_sample_rate", 0.0),
+    export_path=config.get("trace_export_path", "traces.jsonl"),
+    export_format=config.get("trace_export_format", "jsonl"),
+)
+
+shared_cache.configure(
+    config.get("shared_cache_backend", "memory"),
+    config.get("shared_cache_path", "cache/shared_cache.sqlite3"),
+)
+ratelimit.configure(config.get("rate_limits", {}))
+deadline.configure(
+    percentile=config.get("stage_budget_percentile", 90),
+    defaults=config.get("stage_budget_defaults"),
+)
+
+conversation_store = None
+if config.get("conversation_store_path"):
+    conversation_store = ConversationStore(
+        config["conversation_store_path"],
+        max_age_days=config.get("conversation_store_max_age_days", 30),
+        max_messages_per_channel=config.get("conversation_store_max_messages_per_channel", 5000),
+        compact_interval=config.get("conversation_store_compact_interval", 3600),
+    )
+
+# Semantic context needs the conversation store to turn matched ids back into text
+semantic_index = None
+if config.get("context_mode") == "semantic" and conversation_store is not None:
+    semantic_index = SemanticIndex(
+        config.get("semantic_index_path", "cache/semantic_index"),
+        embedding_model=config.get("embedding_model"),
+    )
+    conversation_store.on_remove(semantic_index.remove_messages)
+elif config.get("context_mode") == "semantic":
+    print("context_mode 'semantic' requires conversation_store_path, falling back to recent messages")
+
+replay_log = None
+if config.get("replay_log_path"):
+    replay_log = ReplayLog(
+        config["replay_log_path"],
+        max_bytes=config.get("replay_log_max_bytes", 50_000_000),
+        backups=config.get("replay_log_backups", 5),
+    )
 
-with open("config.json", "r") as f:
-    config = json.load(f)
 
+def apply_config_reload(old, new):
+    if old.get("rate_limits") != new.get("rate_limits"):
+        ratelimit.configure(new.get("rate_limits", {}))
+    tracing_keys = ("trace_sample_rate", "trace_export_path", "trace_export_format")
+    if any(old.get(key) != new.get(key) for key in tracing_keys):
+        tracing.configure(
+            sample_rate=new.get("trace_sample_rate", 0.0),
+            export_path=new.get("trace_export_path", "traces.jsonl"),
+            export_format=new.get("trace_export_format", "jsonl"),
+        )
+    budget_keys = ("stage_budget_percentile", "stage_budget_defaults")
+    if any(old.get(key) != new.get(key) for key in budget_keys):
+        deadline.configure(
+            percentile=new.get("stage_budget_percentile", 90),
+            defaults=new.get("stage_budget_defaults"),
+        )
+    # The new model is loaded lazily otherwise; warm it up if asked to
+    if (
+        "audio" in command_modules
+        and new.get("tts_warmup", False)
+        and old.get("tts_model") != new.get("tts_model")
+    ):
+        asyncio.create_task(warm_up_audio(new))
 
-RESPONSES_URL = f"{config['server_url'].rstrip('/')}/responses"
-CHAT_COMPLETIONS_URL = f"{config['server_url'].rstrip('/')}/chat/completions"
+
+settings.on_reload(apply_config_reload)
+
+# Identical mentions arriving together share one planner + search + model run
+mention_flight = SingleFlight("mention")
 
 
 
@@ -23,168 +111,274 @@ CHAT_COMPLETIONS_URL = f"{config['server_url'].rstrip('/')}/chat/completions"
 intents = discord.Intents.default()
 intents.message_content = True
 
-client = discord.Client(intents=intents)
+# Set by launcher.py when running as one of several shard processes
+SHARD_COUNT = int(os.getenv("SHARD_COUNT") or config.get("shard_count") or 0)
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv("SHARD_IDS", "").split(",") if shard_id] or None
+
+if SHARD_COUNT:
+    client = discord.AutoShardedClient(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    client = discord.Client(intents=intents)
 tree = app_commands.CommandTree(client)
-setup_image_commands(tree, config)
-setup_audio_commands(tree, config)
+
+command_modules = config.get("command_modules", ["images", "audio"])
+if "images" in command_modules:
+    setup_image_commands(tree, config)
+if "audio" in command_modules:
+    setup_audio_commands(tree, config)
+if "icons" in command_modules:
+    # Imported here so numpy and svgpathtools are only needed when enabled
+    from c_icons import setup_icon_commands
+    setup_icon_commands(tree, config)
+
+_ready_once = False
 
 @client.event
 async def on_ready():
-    await tree.sync()
-    print(f'Logged in as {client.user}')
+    global _ready_once
+    # Commands are global, so only the process owning shard 0 needs to sync them
+    if SHARD_IDS is None or 0 in SHARD_IDS:
+        await tree.sync()
+    print(f'Logged in as {client.user} (shards: {SHARD_IDS or "all"})')
+
+    if _ready_once:
+        return
+    _ready_once = True
+
+    if conversation_store is not None:
+        conversation_store.start()
+    if semantic_index is not None:
+        semantic_index.start()
+    if replay_log is not None:
+        replay_log.start()
+
+    ready_seconds = time.perf_counter() - _process_start
+    metrics.startup_seconds.set(IMPORT_SECONDS, phase="imports")
+    metrics.startup_seconds.set(ready_seconds, phase="ready")
+    print(f"Startup: imports {IMPORT_SECONDS:.2f}s, connected and ready after {ready_seconds:.2f}s")
+
+    if "audio" in command_modules and config.get("tts_warmup", False):
+        asyncio.create_task(warm_up_audio(config))
+
+    settings.start_watching(config.get("config_reload_interval", 5.0))
+
+    metrics_port = os.getenv("METRICS_PORT") or config.get("metrics_port")
+    if metrics_port:
+        await metrics.start_metrics_server(config.get("metrics_host", "127.0.0.1"), int(metrics_port))
 
 @client.event
 async def on_message(message):
+    if conversation_store is not None:
+        conversation_store.record_message(message)
+    if semantic_index is not None:
+        semantic_index.add_message(message.channel.id, message.id, f"{message.author.name}: {message.content}")
+
     if message.author == client.user:
         return
     
     if message.content.startswith(f"<@{client.user.id}>"):
-        
-        content = message.content.split(f"<@{client.user.id}>",1)[1].strip()
-        
-        msg_context_length = config.get("msg_context_length", 5)
-        context = await fetch_context_messages(message.channel, msg_context_length, message.id)
-        
-        user_content = ""
-        if context:
-            user_content = f"Previous context in chronological order (newest last):\n{context}\n\n"
-        
-        user_content += f"User message:\n{message.author.name}:{content}\n\n"
-
-        image_urls = get_image_urls_from_message(message)
-
-        if message.reference and message.reference.message_id:
+        guild_config = settings.for_guild(message.guild.id if message.guild else None)
+        allowed, _, _ = ratelimit.limiter.check(
+            "mention",
+            user_id=message.author.id,
+            guild_id=message.guild.id if message.guild else None,
+        )
+        if not allowed:
+            # A reaction is the cheapest way to tell the user without a visible reply
             try:
-                replied = message.reference.resolved
-                if replied is None:
-                    replied = await message.fetch_reference()
-                    
-                user_content += f"Replied to message:\n{replied.author.name}:{replied.content}\n\n"
-                image_urls.extend(get_image_urls_from_message(replied))
-            
-            except discord.NotFound:
+                await message.add_reaction("\N{HOURGLASS}")
+            except discord.HTTPException:
                 pass
-        
+            return
 
-        has_images = len(image_urls) > 0
+        with metrics.timed("mention"), tracing.start_trace(
+            "mention",
+            guild_id=message.guild.id if message.guild else 0,
+            channel_id=message.channel.id,
+            user_id=message.author.id,
+        ), deadline.start(guild_config.get("mention_deadline_seconds", 90)):
+            await handle_mention(message)
 
-        main_messages = []
 
-        if has_images:
-            if config.get("main_system_prompt"):
-                main_messages.append(make_chat_message("system", config["main_system_prompt"]))
-            main_messages.append(make_chat_message("user", user_content, image_urls=image_urls))
-        else:
-            if config.get("main_system_prompt"):
-                main_messages.append(make_user_message(config["main_system_prompt"]))
-            main_messages.append(make_user_message(user_content))
-        
-        
-                
-        web_messages = []
+@client.event
+async def on_message_edit(before, after):
+    if conversation_store is not None:
+        conversation_store.record_edit(after)
+
+
+@client.event
+async def on_message_delete(message):
+    if conversation_store is not None:
+        conversation_store.record_delete(message.id)
+    if semantic_index is not None:
+        semantic_index.remove_messages(message.channel.id, [message.id])
+
 
-        if has_images:
-            if config.get("web_system_prompt"):
-                web_messages.append(make_chat_message("system", config["web_system_prompt"]))
-            web_messages.append(make_chat_message("user", user_content, image_urls=image_urls))
+async def handle_mention(message):
+    config = settings.for_guild(message.guild.id if message.guild else None)
+    content = message.content.split(f"<@{client.user.id}>",1)[1].strip()
+    
+    msg_context_length = config.get("msg_context_length", 5)
+    with metrics.timed("context_fetch"), tracing.span("context_fetch"):
+        if semantic_index is not None:
+            context = await fetch_semantic_context(
+                message.channel,
+                content,
+                config.get("semantic_recent_count", 3),
+                config.get("semantic_top_k", 5),
+                message.id,
+                conversation_store,
+                semantic_index,
+            )
         else:
-            if config.get("web_system_prompt"):
-                web_messages.append(make_user_message(config["web_system_prompt"]))
-            web_messages.append(make_user_message(user_content))
+            context = await fetch_context_messages(message.channel, msg_context_length, message.id, store=conversation_store)
+    
+    user_content = ""
+    if context:
+        user_content = f"Previous context in chronological order (newest last):\n{context}\n\n"
+    
+    coalesce = config.get("coalesce_mentions", True)
+    if coalesce:
+        # The answer may be shared with other users asking the same thing,
+        # so the shared prompt doesn't name who asked; each caller gets it
+        # as a reply to their own message
+        user_content += f"User message:\n{content}\n\n"
+    else:
+        user_content += f"User message:\n{message.author.name}:{content}\n\n"
 
-        
-        image_results = []
+    image_attachments = get_image_attachments_from_message(message)
+
+    replied_id = None
+    if message.reference and message.reference.message_id:
+        replied_id = message.reference.message_id
         try:
-            # Run synchronous API call in executor to avoid blocking event loop
-            loop = asyncio.get_event_loop()
-            if has_images:
-                web_response = await loop.run_in_executor(
-                    None,
-                    lambda: send_chat_completions_request(
-                        CHAT_COMPLETIONS_URL,
-                        os.getenv("HACKCLUB_AI_API_KEY"),
-                        config["image_web_model"],
-                        web_messages,
-                    )
-                )
-                web_response_content = parse_chat_completions_text(web_response)
-            else:
-                web_response = await loop.run_in_executor(
-                    None,
-                    lambda: send_responses_request(
-                        RESPONSES_URL,
-                        os.getenv("HACKCLUB_AI_API_KEY"),
-                        config["web_model"],
-                        web_messages,
-                    )
-                )
-                web_response_content = parse_response_text(web_response)
-            search_query, news_query, image_query = get_search_queries(web_response_content)
-            
-            all_search_results = ""
-            if search_query:
-                search_results = get_search_results(os.getenv("HACKCLUB_SEARCH_API_KEY"), search_query, num_results=5)
-                if search_results != []:
-                    all_search_results += "General Search Results:\n"
-                    for idx, res in enumerate(search_results):
-                        all_search_results += f"{idx+1}. {res}\n"
-            
-            if news_query:
-                news_results = get_news_results(os.getenv("HACKCLUB_SEARCH_API_KEY"), news_query, num_results=5)
-                if news_results != []:
-                    all_search_results += "\nNews Search Results:\n"
-                    for idx, res in enumerate(news_results):
-                        all_search_results += f"{idx+1}. {res}\n"
+            replied = message.reference.resolved
+            if replied is None:
+                replied = await message.fetch_reference()
+                
+            user_content += f"Replied to message:\n{replied.author.name}:{replied.content}\n\n"
+            image_attachments.extend(get_image_attachments_from_message(replied))
         
-            if image_query:
-                image_results = get_image_results(os.getenv("HACKCLUB_SEARCH_API_KEY"), image_query, num_results=1)
-            
-            if all_search_results:
-                if has_images:
-                    main_messages.append(make_chat_message("user", f"Web Search Results:\n{all_search_results}"))
-                else:
-                    main_messages.append(make_user_message(f"Web Search Results:\n{all_search_results}"))
+        except discord.NotFound:
+            pass
+    
+    if config.get("image_input_preprocess", True):
+        with tracing.span("image_preprocess", attachments=len(image_attachments)):
+            image_urls = await prepare_image_urls(
+                image_attachments,
+                max_size=config.get("image_input_max_size", 1024),
+            )
+    else:
+        image_urls = list(dict.fromkeys(attachment.url for attachment in image_attachments))
+
+    has_images = len(image_urls) > 0
+    # Only known for inline images; remote URLs are fetched by the upstream
+    payload_sizes = [data_url_payload_size(url) for url in image_urls]
+    image_bytes = None if None in payload_sizes else sum(payload_sizes)
+
+    # In caption mode only the main model sees the pixels; the planner gets text captions
+    planner_has_images = has_images and config.get("planner_image_mode", "images") != "caption"
+    planner_content = user_content
+    if has_images and not planner_has_images:
+        with tracing.span("image_caption", images=len(image_urls)) as caption_span:
+            captions, caption_bytes = await caption_images(
+                image_urls,
+                chat_completions_url(config),
+                os.getenv("HACKCLUB_AI_API_KEY"),
+                config.get("image_caption_model"),
+            )
+            if image_bytes is not None and caption_bytes is not None:
+                # Without caption mode the planner would get the images too
+                metrics.caption_mode_bytes_saved.inc(image_bytes - caption_bytes)
+                if caption_span is not None:
+                    caption_span.set_attribute("image_bytes", image_bytes)
+                    caption_span.set_attribute("caption_bytes", caption_bytes)
+        planner_content += "Attached images:\n"
+        for idx, caption in enumerate(captions):
+            planner_content += f"{idx+1}. {caption}\n"
+
+    web_messages, main_messages = build_messages(config, user_content, planner_content, image_urls, planner_has_images)
+
+    # Mentions in the same channel see each other in their history, so the
+    # fingerprint is the context source rather than the context text
+    flight_key = make_key(normalize_text(content), message.channel.id, replied_id, image_urls)
+
+    async def run_pipeline():
+        if replay_log is None:
+            return await generate_response(config, web_messages, main_messages, has_images, planner_has_images)
+
+        record = {
+            "trace_id": tracing.current_trace_id(),
+            "guild_id": message.guild.id if message.guild else None,
+            "channel_id": message.channel.id,
+            "message_id": message.id,
+            "config_version": config.version,
+            "user_content": user_content,
+            "planner_content": planner_content,
+            "image_urls": image_urls if config.get("replay_log_images", False) else strip_data_urls(image_urls),
+            "has_images": has_images,
+            "planner_has_images": planner_has_images,
+        }
+        start = time.perf_counter()
+        try:
+            response = await generate_response(
+                config, web_messages, main_messages, has_images, planner_has_images, record=record
+            )
+            record["response"] = response[0]
+            return response
         except Exception as e:
-            print(f"Error during web search: {e}")
-        
+            record["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            replay_log.record(record)
+
+    try:
+        if coalesce:
+            main_response_content, all_search_results = await mention_flight.do(flight_key, run_pipeline)
+        else:
+            main_response_content, all_search_results = await run_pipeline()
+
+        if all_search_results and conversation_store is not None:
+            conversation_store.record_search_results(message.id, message.channel.id, all_search_results)
+
+        send_timeout = deadline.timeout_for(config.get("discord_send_timeout", 30), floor=5)
+        start = time.perf_counter()
         try:
-            # Run synchronous API call in executor to avoid blocking event loop
-            loop = asyncio.get_event_loop()
-            if has_images:
-                main_response = await loop.run_in_executor(
-                    None,
-                    lambda: send_chat_completions_request(
-                        CHAT_COMPLETIONS_URL,
-                        os.getenv("HACKCLUB_AI_API_KEY"),
-                        config["image_main_model"],
-                        main_messages,
-                    )
-                )
-                main_response_content = parse_chat_completions_text(main_response)
-            else:
-                main_response = await loop.run_in_executor(
-                    None,
-                    lambda: send_responses_request(
-                        RESPONSES_URL,
-                        os.getenv("HACKCLUB_AI_API_KEY"),
-                        config["main_model"],
-                        main_messages,
-                    )
+            with metrics.timed("discord_send"), tracing.span("discord_send"):
+                await asyncio.wait_for(
+                    split_send(
+                        message.channel,
+                        main_response_content,
+                        reply_to=message,
+                        file_threshold=config.get("response_file_threshold", 8000),
+                    ),
+                    send_timeout,
                 )
-                main_response_content = parse_response_text(main_response)
-            if image_results != []:
-                main_response_content += "\n\n"
-                for idx, img_url in enumerate(image_results):
-                    main_response_content += f"{img_url}\n"
+        except asyncio.TimeoutError:
+            # Discord itself is slow, so an error reply would most likely time out too
+            print(f"Sending the reply to {message.id} timed out after {send_timeout:.1f}s")
+            metrics.stage_skips.inc(stage="discord_send", reason="timeout")
+        finally:
+            deadline.latency.observe("discord_send", time.perf_counter() - start)
+    except deadline.DeadlineExceeded as e:
+        print(f"Mention {message.id} ran out of time: {e}")
+
+        await split_send(
+            message.channel,
+            ":x: Sorry, that took too long to answer. Please try again later.",
+            reply_to=message,
+        )
+    except Exception as e:
+        print(f"Error during main response generation: {e}")
+        
+        await split_send(
+            message.channel,
+            ":x: Sorry, I encountered an error while trying to process your request. Please try again later.",
+            reply_to=message,
+        )
+    return
 
 
-            await split_send(message.channel, main_response_content)
-        except Exception as e:
-            print(f"Error during main response generation: {e}")
-            
-            await split_send(message.channel, ":x: Sorry, I encountered an error while trying to process your request. Please try again later.")
-        return
-    
-    
 if __name__ == '__main__':
     client.run(os.getenv("DISCORD_BOT_TOKEN"))
\ No newline at end of file
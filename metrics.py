@@ -0,0 +1,220 @@
+import bisect
+import math
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry = []
+_server_runner = None
+
+
+def _label_key(labels):
+    if not labels:
+        return ()
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_key, extra=None):
+    items = list(label_key)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+class Counter:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        self._values[_label_key(labels)] = value
+
+    def get(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts (last one is +Inf), sum, count]
+        self._values = {}
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            self._values[key] = entry
+        # Counts are stored per bucket and made cumulative only when rendering
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def get_count(self, **labels):
+        entry = self._values.get(_label_key(labels))
+        return entry[2] if entry else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+stage_duration = Histogram(
+    "disgrok_stage_duration_seconds",
+    "Time spent in each pipeline stage.",
+)
+stages_in_flight = Gauge(
+    "disgrok_stages_in_flight",
+    "Number of pipeline stages currently running.",
+)
+errors = Counter(
+    "disgrok_errors_total",
+    "Errors by stage, exception type and upstream HTTP status.",
+)
+startup_seconds = Gauge(
+    "disgrok_startup_seconds",
+    "Seconds from process start until imports finished and until the client was ready.",
+)
+tts_batch_size = Histogram(
+    "disgrok_tts_batch_size",
+    "Number of requests synthesized together by the inference service.",
+    buckets=(1, 2, 4, 8, 16, 32),
+)
+rate_limited = Counter(
+    "disgrok_rate_limited_total",
+    "Requests rejected by the rate limiter, by command and scope.",
+)
+image_cache_lookups = Counter(
+    "disgrok_image_cache_lookups_total",
+    "Generated image cache lookups by result.",
+)
+image_cache_bytes_saved = Counter(
+    "disgrok_image_cache_bytes_saved_total",
+    "Bytes of generated images served from the cache instead of generated again.",
+)
+caption_mode_bytes_saved = Counter(
+    "disgrok_caption_mode_bytes_saved_total",
+    "Image bytes not sent upstream because the planner got captions instead of the images.",
+)
+icon_cache_lookups = Counter(
+    "disgrok_icon_cache_lookups_total",
+    "Rendered icon cache lookups by result (memory, disk, coalesced or miss).",
+)
+config_reloads = Counter(
+    "disgrok_config_reloads_total",
+    "Successful reloads of config.json.",
+)
+stage_skips = Counter(
+    "disgrok_stage_skips_total",
+    "Pipeline stages skipped or abandoned, by stage and reason.",
+)
+coalesced_requests = Counter(
+    "disgrok_coalesced_requests_total",
+    "Requests that waited for an identical in-flight request instead of running their own.",
+)
+
+
+def record_error(stage, error):
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status", None) or ""
+    errors.inc(stage=stage, type=type(error).__name__, status=status)
+
+
+@contextmanager
+def timed(stage):
+    """
+    Record the duration of a block in the stage histogram, track it as
+    in flight while it runs and count any exception that escapes it.
+    """
+    stages_in_flight.inc(stage=stage)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        record_error(stage, e)
+        raise
+    finally:
+        stage_duration.observe(time.perf_counter() - start, stage=stage)
+        stages_in_flight.dec(stage=stage)
+
+
+def render_metrics():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def _handle_metrics(request):
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host="127.0.0.1", port=9100):
+    global _server_runner
+    if _server_runner is not None:
+        return
+
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    _server_runner = runner
+    print(f"Metrics available at http://{host}:{port}/metrics")
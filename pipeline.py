@@ -0,0 +1,257 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+
+import deadline
+import metrics
+import tracing
+from helpers import (
+    SEARCH_URL,
+    get_image_results,
+    get_news_results,
+    get_search_queries,
+    get_search_results,
+    make_chat_message,
+    make_user_message,
+    parse_chat_completions_text,
+    parse_response_text,
+    send_chat_completions_request,
+    send_responses_request,
+)
+
+
+# Stages that run after the optional ones and must always get their time
+_REQUIRED_STAGES = ("main_model", "discord_send")
+
+
+def responses_url(config):
+    return f"{config['server_url'].rstrip('/')}/responses"
+
+
+def chat_completions_url(config):
+    return f"{config['server_url'].rstrip('/')}/chat/completions"
+
+
+def search_base_url(config):
+    return config.get("search_url", SEARCH_URL).rstrip("/")
+
+
+def build_messages(config, user_content, planner_content, image_urls, planner_has_images):
+    """
+    Return (planner messages, main model messages) for one mention.
+    """
+    has_images = len(image_urls) > 0
+    main_messages = []
+
+    if has_images:
+        if config.get("main_system_prompt"):
+            main_messages.append(make_chat_message("system", config["main_system_prompt"]))
+        main_messages.append(make_chat_message("user", user_content, image_urls=image_urls))
+    else:
+        if config.get("main_system_prompt"):
+            main_messages.append(make_user_message(config["main_system_prompt"]))
+        main_messages.append(make_user_message(user_content))
+
+    web_messages = []
+
+    if planner_has_images:
+        if config.get("web_system_prompt"):
+            web_messages.append(make_chat_message("system", config["web_system_prompt"]))
+        web_messages.append(make_chat_message("user", planner_content, image_urls=image_urls))
+    else:
+        if config.get("web_system_prompt"):
+            web_messages.append(make_user_message(config["web_system_prompt"]))
+        web_messages.append(make_user_message(planner_content))
+
+    return web_messages, main_messages
+
+
+@contextmanager
+def _observe_latency(stage):
+    # Failures and timeouts count too, or a slowing upstream would never
+    # raise the budget of the stage that is timing out
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        deadline.latency.observe(stage, time.perf_counter() - start)
+
+
+async def _run_search(kind, fn, query, num_results, config, timeout):
+    loop = asyncio.get_event_loop()
+    start = time.perf_counter()
+    with metrics.timed(f"search_{kind}"), tracing.span(f"search_{kind}"):
+        results = await loop.run_in_executor(
+            None,
+            lambda: fn(
+                os.getenv("HACKCLUB_SEARCH_API_KEY"),
+                query,
+                num_results=num_results,
+                search_url=search_base_url(config),
+                timeout=timeout,
+            ),
+        )
+    return {"kind": kind, "query": query, "results": results, "seconds": time.perf_counter() - start}
+
+
+async def _plan_and_search(config, web_messages, planner_has_images, record):
+    """
+    Ask the planner for search queries and run them. Returns the formatted
+    search results and any image result URLs.
+    """
+    all_search_results = ""
+    # Run synchronous API call in executor to avoid blocking event loop
+    loop = asyncio.get_event_loop()
+    planner_model = config["image_web_model"] if planner_has_images else config["web_model"]
+    planner_timeout = deadline.timeout_for(config.get("planner_timeout", 60), then=_REQUIRED_STAGES)
+    start = time.perf_counter()
+    with metrics.timed("planner"), tracing.span("planner"), _observe_latency("planner"):
+        if planner_has_images:
+            web_response = await loop.run_in_executor(
+                None,
+                lambda: send_chat_completions_request(
+                    chat_completions_url(config),
+                    os.getenv("HACKCLUB_AI_API_KEY"),
+                    planner_model,
+                    web_messages,
+                    timeout=planner_timeout,
+                )
+            )
+            web_response_content = parse_chat_completions_text(web_response)
+        else:
+            web_response = await loop.run_in_executor(
+                None,
+                lambda: send_responses_request(
+                    responses_url(config),
+                    os.getenv("HACKCLUB_AI_API_KEY"),
+                    planner_model,
+                    web_messages,
+                    timeout=planner_timeout,
+                )
+            )
+            web_response_content = parse_response_text(web_response)
+    planner_seconds = time.perf_counter() - start
+    record["planner"] = {
+        "model": planner_model,
+        "output": web_response_content,
+        "seconds": planner_seconds,
+    }
+    search_query, news_query, image_query = get_search_queries(web_response_content)
+    record["searches"] = []
+
+    searches = [
+        (kind, fn, query, num_results)
+        for kind, fn, query, num_results in (
+            ("web", get_search_results, search_query, 5),
+            ("news", get_news_results, news_query, 5),
+            ("images", get_image_results, image_query, 1),
+        )
+        if query
+    ]
+    if searches and not deadline.can_run("search", then=_REQUIRED_STAGES):
+        record["skipped"] = ["search"]
+        searches = []
+
+    if searches:
+        search_timeout = deadline.timeout_for(config.get("search_timeout", 10), then=_REQUIRED_STAGES)
+        # The searches are independent, so they run concurrently
+        with _observe_latency("search"):
+            record["searches"] = list(await asyncio.gather(*(
+                _run_search(kind, fn, query, num_results, config, search_timeout)
+                for kind, fn, query, num_results in searches
+            )))
+
+    results_by_kind = {search["kind"]: search["results"] for search in record["searches"]}
+    search_results = results_by_kind.get("web", [])
+    if search_results != []:
+        all_search_results += "General Search Results:\n"
+        for idx, res in enumerate(search_results):
+            all_search_results += f"{idx+1}. {res}\n"
+
+    news_results = results_by_kind.get("news", [])
+    if news_results != []:
+        all_search_results += "\nNews Search Results:\n"
+        for idx, res in enumerate(news_results):
+            all_search_results += f"{idx+1}. {res}\n"
+
+    image_results = results_by_kind.get("images", [])
+
+    return all_search_results, image_results
+
+
+async def generate_response(config, web_messages, main_messages, has_images, planner_has_images, record=None):
+    """
+    Planner, searches and main model for one mention. Returns the response
+    text and the search results that were given to the main model.
+
+    Under a deadline (see deadline.start) the planner and searches are
+    optional: they are skipped when the time left would not also cover
+    the expected main model and send time, and their timeouts are cut so
+    they can't eat into it.
+
+    If record is a dict, the model names, upstream outputs and per-stage
+    durations are added to it for the replay log.
+    """
+    record = {} if record is None else record
+    main_messages = list(main_messages)
+    image_results = []
+    all_search_results = ""
+    if deadline.can_run("planner", then=_REQUIRED_STAGES):
+        try:
+            all_search_results, image_results = await _plan_and_search(config, web_messages, planner_has_images, record)
+        except Exception as e:
+            print(f"Error during web search: {e}")
+            record["search_error"] = f"{type(e).__name__}: {e}"
+    else:
+        record["skipped"] = ["planner", "search"]
+
+    if all_search_results:
+        if has_images:
+            main_messages.append(make_chat_message("user", f"Web Search Results:\n{all_search_results}"))
+        else:
+            main_messages.append(make_user_message(f"Web Search Results:\n{all_search_results}"))
+
+    deadline.check("main_model")
+    # Run synchronous API call in executor to avoid blocking event loop
+    loop = asyncio.get_event_loop()
+    main_model = config["image_main_model"] if has_images else config["main_model"]
+    main_timeout = deadline.timeout_for(config.get("main_model_timeout", 60), then=("discord_send",))
+    start = time.perf_counter()
+    with metrics.timed("main_model"), tracing.span("main_model"), _observe_latency("main_model"):
+        if has_images:
+            main_response = await loop.run_in_executor(
+                None,
+                lambda: send_chat_completions_request(
+                    chat_completions_url(config),
+                    os.getenv("HACKCLUB_AI_API_KEY"),
+                    main_model,
+                    main_messages,
+                    timeout=main_timeout,
+                )
+            )
+            main_response_content = parse_chat_completions_text(main_response)
+        else:
+            main_response = await loop.run_in_executor(
+                None,
+                lambda: send_responses_request(
+                    responses_url(config),
+                    os.getenv("HACKCLUB_AI_API_KEY"),
+                    main_model,
+                    main_messages,
+                    timeout=main_timeout,
+                )
+            )
+            main_response_content = parse_response_text(main_response)
+    main_seconds = time.perf_counter() - start
+    record["main"] = {
+        "model": main_model,
+        "output": main_response_content,
+        "seconds": main_seconds,
+    }
+    if image_results != []:
+        main_response_content += "\n\n"
+        for idx, img_url in enumerate(image_results):
+            main_response_content += f"{img_url}\n"
+
+    return main_response_content, all_search_results
@@ -0,0 +1,158 @@
+import math
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity, rate, now):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def retry_after(self, cost=1):
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def idle_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+def parse_rules(rules):
+    """
+    Turn rate_limits config into {command: {scope: (burst, tokens per
+    second)}}. Raises ValueError for anything malformed.
+    """
+    if not isinstance(rules, dict):
+        raise ValueError("'rate_limits' must map command names to limits")
+    parsed = {}
+    for command, scopes in rules.items():
+        if not isinstance(scopes, dict):
+            raise ValueError(f"Rate limits for '{command}' must map scopes to limits")
+        parsed[command] = {}
+        for scope, limit in scopes.items():
+            if scope not in RateLimiter.SCOPES:
+                raise ValueError(f"Unknown rate limit scope '{scope}' for '{command}'")
+            try:
+                per_minute = float(limit["per_minute"])
+                burst = float(limit.get("burst", max(1.0, per_minute)))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                raise ValueError(f"Rate limit for '{command}' {scope} needs a numeric 'per_minute' and optional 'burst'")
+            if not (math.isfinite(per_minute) and math.isfinite(burst)) or per_minute <= 0 or burst <= 0:
+                raise ValueError(f"Rate limit for '{command}' {scope} must be positive")
+            # A bucket smaller than one token never admits a request
+            if burst < 1:
+                raise ValueError(f"Rate limit burst for '{command}' {scope} must be at least 1, got {burst:g}")
+            parsed[command][scope] = (burst, per_minute / 60)
+    return parsed
+
+
+class RateLimiter:
+    """
+    Token buckets per (command, scope, key), where scope is "user" or
+    "guild". Rules map a command name (or "*" for any command) to
+    per-scope limits: {"user": {"burst": 5, "per_minute": 10}}.
+    """
+
+    SCOPES = ("user", "guild")
+
+    def __init__(self, rules=None, max_buckets=100_000, clock=time.monotonic):
+        self._rules = {}
+        self._buckets = OrderedDict()
+        self.max_buckets = max_buckets
+        self._clock = clock
+        self.configure(rules or {})
+
+    def configure(self, rules):
+        self._rules = parse_rules(rules)
+        # Existing buckets may have been sized for the old rules
+        self._buckets.clear()
+
+    def _limits_for(self, command):
+        return self._rules.get(command) or self._rules.get("*") or {}
+
+    def _bucket(self, key, capacity, rate, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(capacity, rate, now)
+            self._buckets[key] = bucket
+        else:
+            bucket.refill(now)
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _evict(self, now):
+        # Least recently used buckets sit at the front. A bucket that has
+        # refilled completely is indistinguishable from a new one, so drop it.
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if not bucket.idle_full(now) and len(self._buckets) <= self.max_buckets:
+                break
+            self._buckets.popitem(last=False)
+
+    def check(self, command, user_id=None, guild_id=None):
+        """
+        Consume one token from every bucket that applies. Returns
+        (allowed, retry_after_seconds, scope that rejected the request).
+        Nothing is consumed if any bucket is empty.
+        """
+        limits = self._limits_for(command)
+        if not limits:
+            return True, 0.0, None
+
+        now = self._clock()
+        ids = {"user": user_id, "guild": guild_id}
+        buckets = []
+        for scope, (capacity, rate) in limits.items():
+            if ids[scope] is None:
+                continue
+            bucket = self._bucket((command, scope, ids[scope]), capacity, rate, now)
+            wait = bucket.retry_after()
+            if wait > 0:
+                metrics.rate_limited.inc(command=command, scope=scope)
+                self._evict(now)
+                return False, wait, scope
+            buckets.append(bucket)
+
+        for bucket in buckets:
+            bucket.tokens -= 1
+        self._evict(now)
+        return True, 0.0, None
+
+
+limiter = RateLimiter()
+
+
+def configure(rules):
+    limiter.configure(rules or {})
+
+
+async def check_interaction(interaction, command):
+    """
+    Return True if the slash command may run, otherwise answer with an
+    ephemeral message and return False. Must run before the response is deferred.
+    """
+    allowed, retry_after, scope = limiter.check(
+        command,
+        user_id=interaction.user.id,
+        guild_id=interaction.guild_id,
+    )
+    if allowed:
+        return True
+
+    who = "You are" if scope == "user" else "This server is"
+    await interaction.response.send_message(
+        f":hourglass: {who} using `/{command}` too often. Try again in {math.ceil(retry_after)}s.",
+        ephemeral=True,
+    )
+    return False
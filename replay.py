@@ -0,0 +1,175 @@
+"""
+Replay logged mentions (see "replay_log_path") through the planner, search
+and main model pipeline with another config, and compare latency and
+answers with what was recorded.
+
+Usage:
+  python replay.py cache/replay.jsonl.gz --config main_model='"other/model"'
+  python replay.py cache/replay.jsonl.gz --mock --latency-ms 300
+"""
+import argparse
+import asyncio
+import difflib
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+import settings
+from pipeline import build_messages, generate_response
+from replay_log import read_entries, rotated_paths
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return difflib.SequenceMatcher(None, a, b, autojunk=True).ratio()
+
+
+async def replay_entry(config, entry):
+    config = config.for_guild(entry.get("guild_id"))
+    # Images stripped from the log can't be replayed; the rest of the request can
+    image_urls = [url for url in entry.get("image_urls", []) if not url.startswith("sha256:")]
+    planner_has_images = entry.get("planner_has_images", False) and bool(image_urls)
+    web_messages, main_messages = build_messages(
+        config,
+        entry["user_content"],
+        entry["planner_content"],
+        image_urls,
+        planner_has_images,
+    )
+
+    record = {}
+    start = time.perf_counter()
+    try:
+        response, _ = await generate_response(
+            config, web_messages, main_messages, bool(image_urls), planner_has_images, record=record
+        )
+        record["response"] = response
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = time.perf_counter() - start
+    record["images_omitted"] = len(image_urls) < len(entry.get("image_urls", []))
+    return record
+
+
+def stage_seconds(record, stage):
+    if stage == "search":
+        searches = record.get("searches") or []
+        return sum(search["seconds"] for search in searches) if searches else None
+    return (record.get(stage) or {}).get("seconds")
+
+
+async def replay_all(config, entries, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(entry):
+        async with semaphore:
+            return await replay_entry(config, entry)
+
+    return await asyncio.gather(*(one(entry) for entry in entries))
+
+
+def print_report(entries, replays):
+    print(f"{'message':>20} {'recorded':>9} {'replayed':>9} {'similarity':>10}  models")
+    for entry, replay in zip(entries, replays):
+        old_model = (entry.get("main") or {}).get("model", "?")
+        new_model = (replay.get("main") or {}).get("model", "?")
+        models = old_model if old_model == new_model else f"{old_model} -> {new_model}"
+        status = replay.get("error") or f"{similarity(entry.get('response'), replay.get('response')):.0%}"
+        print(f"{entry.get('message_id', '?'):>20} {entry.get('seconds', 0):>8.2f}s {replay['seconds']:>8.2f}s {status:>10}  {models}")
+
+    print()
+    print(f"{'':<16} {'recorded':>10} {'replayed':>10}")
+    for pct in (50, 95):
+        old = percentile([entry.get("seconds", 0) for entry in entries], pct)
+        new = percentile([replay["seconds"] for replay in replays], pct)
+        print(f"{f'total p{pct}':<16} {old:>9.2f}s {new:>9.2f}s")
+    for stage in ("planner", "search", "main"):
+        old = [s for s in (stage_seconds(entry, stage) for entry in entries) if s is not None]
+        new = [s for s in (stage_seconds(replay, stage) for replay in replays) if s is not None]
+        if old or new:
+            old_text = f"{statistics.median(old):>9.2f}s" if old else f"{'-':>10}"
+            new_text = f"{statistics.median(new):>9.2f}s" if new else f"{'-':>10}"
+            print(f"{f'{stage} p50':<16} {old_text} {new_text}")
+
+    errors_old = sum(1 for entry in entries if entry.get("error"))
+    errors_new = sum(1 for replay in replays if replay.get("error"))
+    print(f"{'errors':<16} {errors_old:>10} {errors_new:>10}")
+
+    scores = [
+        similarity(entry.get("response"), replay.get("response"))
+        for entry, replay in zip(entries, replays)
+        if entry.get("response") and replay.get("response")
+    ]
+    if scores:
+        identical = sum(1 for score in scores if score == 1.0)
+        print(f"\nanswer similarity: mean {statistics.mean(scores):.0%}, {identical}/{len(scores)} identical")
+    omitted = sum(1 for replay in replays if replay["images_omitted"])
+    if omitted:
+        print(f"{omitted} request(s) replayed without their images (not stored in the log)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", help="Replay log path; rotated backups next to it are included")
+    parser.add_argument("--config-file", default="config.json")
+    parser.add_argument("--config", action="append", default=[], metavar="KEY=JSON",
+                        help="Override a config value, e.g. --config main_model='\"qwen/qwen3-32b\"'")
+    parser.add_argument("--mock", action="store_true", help="Replay against the local mock upstream")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=0, help="Only replay the most recent N entries")
+    parser.add_argument("--report", help="Write recorded and replayed outputs side by side as JSON lines")
+    sys.path.insert(0, str(Path(__file__).resolve().parent / "benchmarks"))
+    import mock_server
+
+    mock_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    load_dotenv()
+    with open(args.config_file, "r") as f:
+        data = json.load(f)
+    for item in args.config:
+        key, value = item.split("=", 1)
+        data[key] = json.loads(value)
+    if args.mock:
+        base_url = mock_server.start_in_thread(mock_server.upstream_from_args(args))
+        data.update(server_url=base_url, search_url=base_url)
+    settings.validate(data)
+    config = settings.Config(data)
+
+    entries = list(read_entries(rotated_paths(args.log)))
+    if args.limit:
+        entries = entries[-args.limit:]
+    if not entries:
+        print(f"No entries in {args.log}")
+        return
+    print(f"Replaying {len(entries)} request(s) with concurrency {args.concurrency}\n")
+
+    replays = asyncio.run(replay_all(config, entries, args.concurrency))
+    print_report(entries, replays)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            for entry, replay in zip(entries, replays):
+                f.write(json.dumps({
+                    "message_id": entry.get("message_id"),
+                    "recorded": {key: entry.get(key) for key in ("planner", "searches", "main", "response", "error", "seconds")},
+                    "replayed": replay,
+                }, ensure_ascii=False) + "\n")
+        print(f"\nSide-by-side report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def strip_data_urls(image_urls):
+    """
+    Replace inline images with a hash of their content. Keeps the log
+    small; a replay then runs without the pixels.
+    """
+    return [
+        f"sha256:{hashlib.sha256(url.encode('utf-8')).hexdigest()}" if url.startswith("data:") else url
+        for url in image_urls
+    ]
+
+
+def read_entries(paths):
+    """
+    Yield logged entries from one or more replay log files, oldest file
+    first when given a rotated set.
+    """
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def rotated_paths(path):
+    """
+    Return path and its rotated backups (path.1, path.2, ...) that exist,
+    oldest first.
+    """
+    backups = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        backups.append(f"{path}.{index}")
+        index += 1
+    current = [path] if os.path.exists(path) else []
+    return list(reversed(backups)) + current
+
+
+class ReplayLog:
+    """
+    Append-only log of mention pipeline inputs and upstream outputs as
+    gzip-compressed JSON lines. Each flush appends one gzip member, which
+    gzip readers treat as one continuous stream. The file is rotated to
+    path.1, path.2, ... once it grows past max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=50_000_000, backups=5, flush_interval=2.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="replay-log")
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def record(self, entry):
+        entry.setdefault("ts", time.time())
+        self._pending.append(entry)
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def _write_batch(self, entries):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        with open(self.path, "ab") as f:
+            f.write(gzip.compress(lines.encode("utf-8")))
+        if os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        entries, self._pending = self._pending, []
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._write_batch, entries)
+        except Exception as e:
+            print(f"Error writing {len(entries)} replay log entries: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
@@ -0,0 +1,324 @@
+import asyncio
+import json
+import os
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Hyperplanes are fixed by seed so codes stay valid across restarts
+_LSH_BITS = 256
+_LSH_WORDS = _LSH_BITS // 64
+_LSH_SEED = 1234
+
+
+class HashingEmbedder:
+    """
+    Dependency-free text embedding: signed feature hashing of word unigrams
+    and bigrams, L2-normalized. crc32 is used instead of hash() so vectors
+    are stable across processes.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN_RE.findall(text.lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name):
+        # Optional dependency, only needed when embedding_model is configured
+        from sentence_transformers import SentenceTransformer
+
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        return self._model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _hamming_distances(codes, query_code):
+    xored = np.bitwise_xor(codes, query_code)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xored).sum(axis=1, dtype=np.int32)
+    # numpy < 2.0 has no popcount ufunc
+    return _POPCOUNT_TABLE[xored.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+
+class ChannelIndex:
+    """
+    Append-only vectors for one channel in memory-mapped files: float16
+    vectors, int64 message ids and 256-bit LSH codes, plus a list of
+    removed ids. Search is an exhaustive scan: every code is ranked by
+    Hamming distance, then the closest candidates are re-scored exactly.
+    """
+
+    def __init__(self, directory, dim, hyperplanes):
+        self.directory = directory
+        self.dim = dim
+        self._hyperplanes = hyperplanes
+        os.makedirs(directory, exist_ok=True)
+        self._paths = {
+            "vectors": os.path.join(directory, "vectors.f16"),
+            "ids": os.path.join(directory, "ids.i64"),
+            "codes": os.path.join(directory, "codes.u256"),
+            "removed": os.path.join(directory, "removed.i64"),
+        }
+        self._row_bytes = {
+            "vectors": dim * 2,
+            "ids": 8,
+            "codes": _LSH_WORDS * 8,
+        }
+        self._write_meta()
+        self.count = self._recover()
+        self._removed = self._read_removed()
+        self._maps = None
+        self._max_id = int(self._mapped()[1].max()) if self.count else 0
+
+    def _write_meta(self):
+        meta_path = os.path.join(self.directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                if json.load(f).get("dim") != self.dim:
+                    raise ValueError(f"Index at {self.directory} was built with a different embedding size")
+            return
+        with open(meta_path, "w") as f:
+            json.dump({"dim": self.dim}, f)
+
+    def _recover(self):
+        """
+        Truncate the three row files to the rows they all have. An append
+        interrupted by a crash otherwise leaves extra rows in some of them
+        and every later row would pair a vector with the wrong message id.
+        """
+        rows = {}
+        for name, row_bytes in self._row_bytes.items():
+            path = self._paths[name]
+            rows[name] = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+        count = min(rows.values())
+        for name, row_bytes in self._row_bytes.items():
+            path = self._paths[name]
+            if os.path.exists(path) and os.path.getsize(path) != count * row_bytes:
+                print(f"Semantic index {self.directory}: dropping partial rows from {name}")
+                os.truncate(path, count * row_bytes)
+        return count
+
+    def _read_removed(self):
+        path = self._paths["removed"]
+        if not os.path.exists(path):
+            return np.empty(0, dtype=np.int64)
+        with open(path, "rb") as f:
+            data = f.read()
+        return np.unique(np.frombuffer(data[:len(data) // 8 * 8], dtype=np.int64))
+
+    def _codes_for(self, vectors):
+        bits = (vectors @ self._hyperplanes) > 0
+        return np.packbits(bits, axis=1, bitorder="little").view(np.uint64)
+
+    def _new_rows(self, message_ids):
+        """
+        Mask of the ids not indexed yet. Ids are snowflakes, so anything
+        newer than the newest indexed id is new without a lookup; only
+        backfilled history needs to be checked against the ids file.
+        """
+        message_ids = np.asarray(message_ids, dtype=np.int64)
+        _, first = np.unique(message_ids, return_index=True)
+        new = np.zeros(len(message_ids), dtype=bool)
+        new[first] = True
+        older = new & (message_ids <= self._max_id)
+        if older.any():
+            new[older] = ~np.isin(message_ids[older], self._mapped()[1])
+        return new
+
+    def add(self, message_ids, vectors):
+        message_ids = np.asarray(message_ids, dtype=np.int64)
+        new = self._new_rows(message_ids)
+        if not new.any():
+            return
+        message_ids = message_ids[new]
+        vectors = np.asarray(vectors, dtype=np.float32)[new]
+        codes = self._codes_for(vectors)
+        # Partial appends are dropped by _recover on the next open
+        with open(self._paths["vectors"], "ab") as f:
+            f.write(vectors.astype(np.float16).tobytes())
+        with open(self._paths["codes"], "ab") as f:
+            f.write(codes.tobytes())
+        with open(self._paths["ids"], "ab") as f:
+            f.write(message_ids.tobytes())
+        self.count += len(message_ids)
+        self._max_id = max(self._max_id, int(message_ids.max()))
+        self._maps = None
+
+    def remove(self, message_ids):
+        """
+        Exclude messages from search. Their rows stay in the files.
+        """
+        message_ids = np.asarray(list(message_ids), dtype=np.int64)
+        if message_ids.size == 0:
+            return
+        with open(self._paths["removed"], "ab") as f:
+            f.write(message_ids.tobytes())
+        self._removed = np.union1d(self._removed, message_ids)
+
+    def _mapped(self):
+        if self._maps is None:
+            if self.count == 0:
+                return (
+                    np.empty((0, self.dim), dtype=np.float16),
+                    np.empty(0, dtype=np.int64),
+                    np.empty((0, _LSH_WORDS), dtype=np.uint64),
+                )
+            self._maps = (
+                np.memmap(self._paths["vectors"], dtype=np.float16, mode="r", shape=(self.count, self.dim)),
+                np.memmap(self._paths["ids"], dtype=np.int64, mode="r", shape=(self.count,)),
+                np.memmap(self._paths["codes"], dtype=np.uint64, mode="r", shape=(self.count, _LSH_WORDS)),
+            )
+        return self._maps
+
+    def search(self, query_vector, top_k=5, before_id=None, candidates=2048):
+        """
+        Return up to top_k (message id, cosine similarity) pairs, optionally
+        only for messages with ids below before_id.
+        """
+        if self.count == 0:
+            return []
+        vectors, ids, codes = self._mapped()
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_code = self._codes_for(query_vector[np.newaxis, :])
+
+        distances = _hamming_distances(codes, query_code)
+        if before_id is not None:
+            distances[ids >= before_id] = _LSH_BITS + 1
+        if self._removed.size:
+            distances[np.isin(ids, self._removed)] = _LSH_BITS + 1
+
+        candidates = min(candidates, self.count)
+        if candidates < self.count:
+            candidate_idx = np.argpartition(distances, candidates - 1)[:candidates]
+        else:
+            candidate_idx = np.arange(self.count)
+        candidate_idx = candidate_idx[distances[candidate_idx] <= _LSH_BITS]
+        if candidate_idx.size == 0:
+            return []
+
+        scores = vectors[candidate_idx].astype(np.float32) @ query_vector
+        order = np.argsort(-scores)[:top_k]
+        return [(int(ids[candidate_idx[i]]), float(scores[i])) for i in order]
+
+
+class SemanticIndex:
+    """
+    Per-channel embedding indexes under one directory. Messages are embedded
+    and appended in batches on a background thread.
+    """
+
+    def __init__(self, root, embedding_model=None, flush_interval=2.0):
+        self.root = root
+        self.embedding_model = embedding_model
+        self.flush_interval = flush_interval
+        self._embedder = None
+        self._hyperplanes = None
+        self._channels = {}
+        self._pending = []
+        self._pending_removals = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="semantic-index")
+        self._task = None
+
+    def _get_embedder(self):
+        if self._embedder is None:
+            if self.embedding_model:
+                self._embedder = SentenceTransformerEmbedder(self.embedding_model)
+            else:
+                self._embedder = HashingEmbedder()
+            rng = np.random.default_rng(_LSH_SEED)
+            self._hyperplanes = rng.standard_normal((self._embedder.dim, _LSH_BITS)).astype(np.float32)
+        return self._embedder
+
+    def _channel(self, channel_id):
+        index = self._channels.get(channel_id)
+        if index is None:
+            embedder = self._get_embedder()
+            index = ChannelIndex(os.path.join(self.root, str(channel_id)), embedder.dim, self._hyperplanes)
+            self._channels[channel_id] = index
+        return index
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    def add_message(self, channel_id, message_id, text):
+        if text and text.strip():
+            self._pending.append((channel_id, message_id, text))
+
+    def remove_messages(self, channel_id, message_ids):
+        """
+        Stop returning deleted messages. Applied with the next flush, after
+        any pending adds.
+        """
+        self._pending_removals.extend((channel_id, message_id) for message_id in message_ids)
+
+    def _index_batch(self, items, removals=()):
+        if items:
+            self._add_batch(items)
+        by_channel = {}
+        for channel_id, message_id in removals:
+            by_channel.setdefault(channel_id, []).append(message_id)
+        for channel_id, message_ids in by_channel.items():
+            # Nothing to hide in a channel that was never indexed
+            if channel_id in self._channels or os.path.isdir(os.path.join(self.root, str(channel_id))):
+                self._channel(channel_id).remove(message_ids)
+
+    def _add_batch(self, items):
+        embedder = self._get_embedder()
+        vectors = embedder.embed([text for _, _, text in items])
+        by_channel = {}
+        for row, (channel_id, message_id, _) in enumerate(items):
+            by_channel.setdefault(channel_id, ([], []))
+            by_channel[channel_id][0].append(message_id)
+            by_channel[channel_id][1].append(row)
+        for channel_id, (message_ids, rows) in by_channel.items():
+            self._channel(channel_id).add(message_ids, vectors[rows])
+
+    async def flush(self):
+        if not self._pending and not self._pending_removals:
+            return
+        items, self._pending = self._pending, []
+        removals, self._pending_removals = self._pending_removals, []
+        try:
+            await self._run(self._index_batch, items, removals)
+        except Exception as e:
+            print(f"Error indexing {len(items)} messages: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _search(self, channel_id, text, top_k, before_id):
+        query_vector = self._get_embedder().embed([text])[0]
+        return self._channel(channel_id).search(query_vector, top_k=top_k, before_id=before_id)
+
+    async def search(self, channel_id, text, top_k=5, before_id=None):
+        await self.flush()
+        return await self._run(self._search, channel_id, text, top_k, before_id)
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import os
+import re
+
+import metrics
+import ratelimit
+import tracing
+
+
+REQUIRED_KEYS = ("server_url", "main_model", "web_model")
+
+# Keys read once at startup. Changing them in a running bot has no effect
+# until it is restarted.
+PROCESS_KEYS = frozenset((
+    "command_modules",
+    "context_mode",
+    "conversation_store_path",
+    "image_gen_concurrency",
+    "image_gen_max_count",
+    "metrics_host",
+    "metrics_port",
+    "replay_log_backups",
+    "replay_log_max_bytes",
+    "replay_log_path",
+    "semantic_index_path",
+    "embedding_model",
+    "icon_render_workers",
+    "shard_count",
+    "shared_cache_backend",
+    "shared_cache_path",
+))
+
+# Keys that only make sense process-wide, either because they are read at
+# startup or because they select model weights loaded into this process
+GUILD_FORBIDDEN_KEYS = PROCESS_KEYS | {
+    "config_reload_interval",
+    "guild_overrides",
+    "rate_limits",
+    "stage_budget_defaults",
+    "stage_budget_percentile",
+    "tts_model",
+    "voice_clone_model",
+}
+
+_POSITIVE_INT_KEYS = (
+    "msg_context_length",
+    "semantic_recent_count",
+    "semantic_top_k",
+    "image_input_max_size",
+    "image_gen_max_per_user",
+    "response_file_threshold",
+)
+
+# What icon/rendering.py accepts as a palette color
+_HEX_COLOR_RE = re.compile(r"#?[0-9a-fA-F]{6}")
+
+_POSITIVE_SECONDS_KEYS = (
+    "planner_timeout",
+    "search_timeout",
+    "main_model_timeout",
+    "discord_send_timeout",
+)
+
+
+def _validate_values(data, where):
+    for key in _POSITIVE_INT_KEYS:
+        if key in data:
+            value = data[key]
+            if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+                raise ValueError(f"{where}: '{key}' must be a positive integer, got {value!r}")
+    for key in _POSITIVE_SECONDS_KEYS:
+        if key in data:
+            value = data[key]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+                raise ValueError(f"{where}: '{key}' must be a positive number of seconds, got {value!r}")
+    # 0 turns the mention deadline off
+    value = data.get("mention_deadline_seconds", 0)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise ValueError(f"{where}: 'mention_deadline_seconds' must be a number of seconds, got {value!r}")
+    for key in ("server_url", "main_model", "web_model", "image_main_model", "image_web_model"):
+        if key in data and not (isinstance(data[key], str) and data[key]):
+            raise ValueError(f"{where}: '{key}' must be a non-empty string")
+    if data.get("planner_image_mode", "images") not in ("images", "caption"):
+        raise ValueError(f"{where}: 'planner_image_mode' must be 'images' or 'caption'")
+    palettes = data.get("icon_palettes", {})
+    if not isinstance(palettes, dict):
+        raise ValueError(f"{where}: 'icon_palettes' must map names to lists of colors")
+    for name, colors in palettes.items():
+        if (
+            not isinstance(colors, list)
+            or not colors
+            or not all(isinstance(color, str) and _HEX_COLOR_RE.fullmatch(color) for color in colors)
+        ):
+            raise ValueError(f"{where}: icon palette '{name}' must be a list of #rrggbb colors, got {colors!r}")
+
+
+def validate(data):
+    """
+    Raise ValueError if the config can't be used. Checks the types of the
+    values the pipeline relies on, not every key.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("config must be a JSON object")
+    for key in REQUIRED_KEYS:
+        if key not in data:
+            raise ValueError(f"config is missing '{key}'")
+    _validate_values(data, "config")
+    # Parsed the same way the reload listeners will apply them, so a bad
+    # value rejects the reload instead of failing halfway through applying it
+    ratelimit.parse_rules(data.get("rate_limits", {}))
+    tracing.parse_settings(data.get("trace_sample_rate", 0.0), data.get("trace_export_format", "jsonl"))
+
+    overrides = data.get("guild_overrides", {})
+    if not isinstance(overrides, dict):
+        raise ValueError("'guild_overrides' must map guild ids to objects")
+    for guild_id, values in overrides.items():
+        if not str(guild_id).isdigit() or not isinstance(values, dict):
+            raise ValueError(f"guild_overrides: '{guild_id}' must be a guild id mapping to an object")
+        forbidden = sorted(GUILD_FORBIDDEN_KEYS.intersection(values))
+        if forbidden:
+            raise ValueError(f"guild_overrides[{guild_id}]: {', '.join(forbidden)} can't be set per guild")
+        _validate_values(values, f"guild_overrides[{guild_id}]")
+
+
+class Config:
+    """
+    Read-only view of one version of config.json. A request should fetch
+    its Config once and use it throughout, so a reload halfway through
+    never mixes old and new values.
+    """
+
+    def __init__(self, data, version=0, guild_id=None):
+        self._data = data
+        self.version = version
+        self.guild_id = guild_id
+        self._guild_configs = {}
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def to_dict(self):
+        return dict(self._data)
+
+    def for_guild(self, guild_id):
+        if guild_id is None or self.guild_id is not None:
+            return self
+        config = self._guild_configs.get(guild_id)
+        if config is None:
+            overrides = self._data.get("guild_overrides", {}).get(str(guild_id))
+            if overrides:
+                config = Config({**self._data, **overrides}, self.version, guild_id)
+            else:
+                config = self
+            self._guild_configs[guild_id] = config
+        return config
+
+
+_path = None
+_mtime = None
+_rejected_mtime = None
+_current = None
+_listeners = []
+_task = None
+
+
+def load(path="config.json"):
+    """
+    Read, validate and install the config at path. Raises on an invalid
+    file, since there is no previous version to fall back to.
+    """
+    global _path, _mtime, _current
+    mtime = os.path.getmtime(path)
+    with open(path, "r") as f:
+        data = json.load(f)
+    validate(data)
+    _path = path
+    _mtime = mtime
+    _current = Config(data, version=0)
+    return _current
+
+
+def current():
+    if _current is None:
+        raise RuntimeError("settings.load() must be called before the config is used")
+    return _current
+
+
+def for_guild(guild_id):
+    return current().for_guild(guild_id)
+
+
+def on_reload(callback):
+    """
+    Call callback(old, new) after each successful reload.
+    """
+    _listeners.append(callback)
+
+
+def reload_if_changed():
+    """
+    Swap in config.json if it changed since the last load. An invalid file
+    is reported and the running config is kept. Returns True on reload.
+    """
+    global _mtime, _rejected_mtime, _current
+    try:
+        mtime = os.path.getmtime(_path)
+    except OSError as e:
+        print(f"Ignoring config reload: {e}")
+        return False
+    if mtime in (_mtime, _rejected_mtime):
+        return False
+
+    try:
+        with open(_path, "r") as f:
+            data = json.load(f)
+        validate(data)
+    except (OSError, ValueError) as e:
+        # Also covers a half-written file; finishing the write changes the mtime again
+        _rejected_mtime = mtime
+        print(f"Ignoring config reload: {e}")
+        metrics.record_error("config_reload", e)
+        return False
+
+    old = _current
+    _mtime = mtime
+    _current = Config(data, version=old.version + 1)
+    changed = sorted(
+        key for key in set(old.to_dict()) | set(data)
+        if old.get(key) != data.get(key)
+    )
+    print(f"Reloaded config (version {_current.version}), changed: {', '.join(changed) or 'nothing'}")
+    restart_needed = PROCESS_KEYS.intersection(changed)
+    if restart_needed:
+        print(f"Restart required for: {', '.join(sorted(restart_needed))}")
+    metrics.config_reloads.inc()
+
+    for callback in _listeners:
+        try:
+            callback(old, _current)
+        except Exception as e:
+            print(f"Error applying config reload: {e}")
+            metrics.record_error("config_reload", e)
+    return True
+
+
+async def _watch(interval):
+    while True:
+        await asyncio.sleep(interval)
+        reload_if_changed()
+
+
+def start_watching(interval=5.0):
+    global _task
+    if _task is None and interval and interval > 0:
+        _task = asyncio.create_task(_watch(interval))
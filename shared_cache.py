@@ -0,0 +1,175 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class MemoryBackend:
+    blocking = False
+
+    def __init__(self):
+        self._namespaces = {}
+
+    def get(self, namespace, key):
+        entries = self._namespaces.get(namespace)
+        if entries is None:
+            return None
+        value = entries.get(key)
+        if value is not None:
+            entries.move_to_end(key)
+        return value
+
+    def set(self, namespace, key, value, max_entries):
+        entries = self._namespaces.setdefault(namespace, OrderedDict())
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > max_entries:
+            entries.popitem(last=False)
+
+
+class SQLiteBackend:
+    """
+    Cache shared between processes through a single SQLite file in WAL mode,
+    so shards see each other's entries.
+    """
+
+    # Eviction scans the namespace, so only run it every few writes
+    EVICT_EVERY = 32
+    # A hit only rewrites last_used once it is this many seconds old, so
+    # reads of hot entries don't each take the write lock. Eviction order
+    # is only this precise.
+    TOUCH_INTERVAL = 60
+    # Calls can wait up to the busy timeout on another process's write lock
+    blocking = True
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache (namespace, last_used)")
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-cache")
+
+    def get(self, namespace, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, last_used FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[1] >= self.TOUCH_INTERVAL:
+                self._conn.execute(
+                    "UPDATE cache SET last_used = ? WHERE namespace = ? AND key = ?",
+                    (now, namespace, key),
+                )
+        return row[0]
+
+    def set(self, namespace, key, value, max_entries):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, last_used) VALUES (?, ?, ?, ?)",
+                (namespace, key, value, time.time()),
+            )
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._conn.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                    " SELECT key FROM cache WHERE namespace = ?"
+                    " ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (namespace, namespace, max_entries),
+                )
+
+
+def configure(backend="memory", path="cache/shared_cache.sqlite3"):
+    global _backend
+    with _backend_lock:
+        if backend == "sqlite":
+            _backend = SQLiteBackend(path)
+        elif backend == "memory":
+            _backend = MemoryBackend()
+        else:
+            raise ValueError(f"Unknown shared cache backend: {backend}")
+
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = MemoryBackend()
+    return _backend
+
+
+class Cache:
+    """
+    A named LRU cache of string values. The storage backend is resolved on
+    each access, so caches can be created at import time before configure().
+    Code on the event loop should use aget/aset, which run blocking backends
+    on their own thread and treat backend errors as a miss.
+    """
+
+    def __init__(self, namespace, max_entries):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get(self, key):
+        return self._count(_get_backend().get(self.namespace, key))
+
+    def set(self, key, value):
+        _get_backend().set(self.namespace, key, value, self.max_entries)
+
+    async def aget(self, key):
+        backend = _get_backend()
+        if not backend.blocking:
+            return self._count(backend.get(self.namespace, key))
+        loop = asyncio.get_running_loop()
+        try:
+            value = await loop.run_in_executor(backend.executor, backend.get, self.namespace, key)
+        except sqlite3.Error as e:
+            print(f"Error reading shared cache '{self.namespace}': {e}")
+            value = None
+        return self._count(value)
+
+    async def aset(self, key, value):
+        backend = _get_backend()
+        if not backend.blocking:
+            backend.set(self.namespace, key, value, self.max_entries)
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(backend.executor, backend.set, self.namespace, key, value, self.max_entries)
+        except sqlite3.Error as e:
+            print(f"Error writing shared cache '{self.namespace}': {e}")
+
+    def __contains__(self, key):
+        return self.get(key) is not None
@@ -0,0 +1,81 @@
+import asyncio
+import hashlib
+import re
+
+import metrics
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = "?!.,;: "
+
+
+def normalize_text(text):
+    """
+    Fold case and whitespace and drop trailing punctuation, so "What's X?"
+    and "what's  x" count as the same question.
+    """
+    return _WHITESPACE_RE.sub(" ", text or "").strip().lower().rstrip(_TRAILING_PUNCTUATION)
+
+
+def make_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers arriving while a call
+    for their key is in flight wait for its result (or exception) instead
+    of starting their own. If the caller running the call is cancelled,
+    one of the waiting callers takes over and runs its own fn. Nothing is
+    cached once the call finishes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+
+    def in_flight(self, key):
+        return key in self._calls
+
+    async def do(self, key, fn):
+        """
+        Return the result of fn() for key, sharing it with concurrent callers.
+        fn is a zero-argument coroutine function.
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            metrics.coalesced_requests.inc(group=self.name)
+        while future is not None:
+            try:
+                # A follower giving up must not cancel the call for everyone else
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                # The first follower to wake up becomes the new leader
+                future = self._calls.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody was waiting for it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
@@ -0,0 +1,66 @@
+"""
+Code fence handling in split_message.
+"""
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from helpers import split_message
+
+
+def prose(count):
+    return "\n".join(f"Line {idx} of ordinary prose that should stay prose." for idx in range(count))
+
+
+def test_chunks_fit_and_keep_the_text():
+    text = prose(200)
+    chunks = split_message(text, 500)
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert "\n".join(chunks).split() == text.split()
+
+
+def test_inline_backticks_do_not_open_a_fence():
+    text = "```inline code```\n" + prose(100)
+    chunks = split_message(text, 400)
+    assert len(chunks) > 1
+    for chunk in chunks[1:]:
+        assert not chunk.startswith("```")
+    for chunk in chunks:
+        assert not chunk.endswith("\n```")
+
+
+def test_fence_is_reopened_with_only_its_language():
+    text = "Intro\n```python title=example.py\n" + "\n".join(f"x_{idx} = {idx}" for idx in range(200)) + "\n```\nDone"
+    chunks = split_message(text, 300)
+    assert len(chunks) > 2
+    assert all(len(chunk) <= 300 for chunk in chunks)
+    for chunk in chunks[:-1]:
+        assert chunk.endswith("\n```")
+    for chunk in chunks[1:]:
+        assert chunk.startswith("```python\n")
+    assert chunks[-1].endswith("\n```\nDone")
+
+
+def test_longer_fence_is_not_closed_by_an_inner_one():
+    inner = "\n".join(["```js", "let a = 1;", "```"] * 40)
+    text = "````markdown\n" + inner + "\n````\nAfter the fence.\n" + prose(20)
+    chunks = split_message(text, 300)
+    fenced = [chunk for chunk in chunks if "let a" in chunk]
+    assert len(fenced) > 1
+    for chunk in fenced[1:]:
+        assert chunk.startswith("````markdown\n")
+    for chunk in fenced[:-1]:
+        assert chunk.endswith("\n````")
+    # Prose after the closing fence is not wrapped in a new fence
+    after = [chunk for chunk in chunks if chunk.startswith("Line")]
+    assert after and all("`" not in chunk for chunk in after)
+
+
+def test_fence_closing_is_counted_once():
+    text = "```\ncode\n```\n" + prose(100)
+    chunks = split_message(text, 400)
+    for chunk in chunks[1:]:
+        assert not chunk.startswith("```")
+        assert not chunk.endswith("```")
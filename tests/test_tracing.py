@@ -0,0 +1,130 @@
+"""
+Span structure of a mention pipeline run against the mock upstream in
+benchmarks/mock_server.py.
+"""
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "benchmarks"))
+
+import mock_server
+import settings
+import tracing
+from pipeline import build_messages, generate_response
+
+
+@pytest.fixture(scope="module")
+def upstream_url():
+    return mock_server.start_in_thread(mock_server.MockUpstream(latency_ms=5, jitter=0, seed=0))
+
+
+@pytest.fixture
+def export_path(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    yield path
+    tracing.configure()
+
+
+def make_config(upstream_url):
+    return settings.Config({
+        "server_url": upstream_url,
+        "search_url": upstream_url,
+        "main_model": "main",
+        "web_model": "planner",
+        "image_main_model": "image-main",
+        "image_web_model": "image-planner",
+        "web_system_prompt": "Reply with General Query, News Query and Image Query lines.",
+    })
+
+
+def run_mention(config):
+    web_messages, main_messages = build_messages(config, "User message:\nalice: hi", "User message:\nalice: hi", [], False)
+
+    async def run():
+        with tracing.start_trace("mention", channel_id=42) as root:
+            with tracing.span("context_fetch", messages=3):
+                pass
+            await generate_response(config, web_messages, main_messages, False, False)
+            return root
+
+    root = asyncio.run(run())
+    tracing.flush()
+    return root
+
+
+def read_spans(path):
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_pipeline_spans_nest_under_the_root(upstream_url, export_path):
+    tracing.configure(sample_rate=1.0, export_path=str(export_path))
+    root = run_mention(make_config(upstream_url))
+
+    spans = read_spans(export_path)
+    by_name = {span["name"]: span for span in spans}
+    assert {span["trace_id"] for span in spans} == {root.trace.trace_id}
+    assert set(by_name) == {
+        "mention", "context_fetch", "planner", "search_web", "search_news", "search_images", "main_model",
+    }
+
+    mention = by_name["mention"]
+    assert mention["parent_id"] is None
+    assert mention["attributes"] == {"channel_id": 42}
+    assert by_name["context_fetch"]["attributes"] == {"messages": 3}
+    for name, span in by_name.items():
+        if name != "mention":
+            assert span["parent_id"] == mention["span_id"]
+        assert span["error"] is None
+        assert mention["start_ns"] <= span["start_ns"] <= span["end_ns"] <= mention["end_ns"]
+
+    # The searches run concurrently and each still gets its own span
+    assert len({by_name[f"search_{kind}"]["span_id"] for kind in ("web", "news", "images")}) == 3
+
+
+def test_nested_spans_and_errors(export_path):
+    tracing.configure(sample_rate=1.0, export_path=str(export_path))
+    with pytest.raises(ValueError):
+        with tracing.start_trace("outer"):
+            with tracing.span("middle"):
+                with tracing.span("inner", step=1):
+                    raise ValueError("boom")
+    tracing.flush()
+
+    by_name = {span["name"]: span for span in read_spans(export_path)}
+    assert by_name["middle"]["parent_id"] == by_name["outer"]["span_id"]
+    assert by_name["inner"]["parent_id"] == by_name["middle"]["span_id"]
+    assert by_name["inner"]["attributes"] == {"step": 1}
+    assert all(span["error"] == "ValueError: boom" for span in by_name.values())
+
+
+def test_unsampled_traces_export_nothing(upstream_url, export_path):
+    tracing.configure(sample_rate=0.0, export_path=str(export_path))
+    assert run_mention(make_config(upstream_url)) is None
+    assert read_spans(export_path) == []
+
+    # Spans outside any trace are no-ops
+    with tracing.span("orphan") as orphan:
+        assert orphan is None
+    assert tracing.current_trace_id() is None
+
+
+def test_otlp_export(export_path):
+    tracing.configure(sample_rate=1.0, export_path=str(export_path), export_format="otlp")
+    with tracing.start_trace("outer", user_id=7):
+        with tracing.span("inner"):
+            pass
+    tracing.flush()
+
+    (request,) = read_spans(export_path)
+    spans = request["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    outer, inner = sorted(spans, key=lambda span: "parentSpanId" in span)
+    assert inner["parentSpanId"] == outer["spanId"]
+    assert outer["attributes"] == [{"key": "user_id", "value": {"intValue": "7"}}]
@@ -0,0 +1,211 @@
+import contextvars
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+_settings = {
+    "sample_rate": 0.0,
+    "export_path": "traces.jsonl",
+    "export_format": "jsonl",
+    "service_name": "disgrok",
+}
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+# Exports are appended by one background thread, in the order traces finish
+_export_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-export")
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1_000_000 if self.end_ns else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+
+
+def parse_settings(sample_rate=0.0, export_format="jsonl"):
+    """
+    Return the sample rate as a float, raising ValueError for settings
+    configure() can't use.
+    """
+    if export_format not in ("jsonl", "otlp"):
+        raise ValueError(f"Unknown trace export format: {export_format}")
+    if isinstance(sample_rate, bool) or not isinstance(sample_rate, (int, float)) or not 0 <= sample_rate <= 1:
+        raise ValueError(f"Trace sample rate must be a number from 0 to 1, got {sample_rate!r}")
+    return float(sample_rate)
+
+
+def configure(sample_rate=0.0, export_path="traces.jsonl", export_format="jsonl", service_name="disgrok"):
+    sample_rate = parse_settings(sample_rate, export_format)
+    _settings.update(
+        sample_rate=sample_rate,
+        export_path=export_path,
+        export_format=export_format,
+        service_name=service_name,
+    )
+
+
+def current_span():
+    return _current_span.get()
+
+
+def current_trace_id():
+    span = _current_span.get()
+    return span.trace.trace_id if span else None
+
+
+@contextmanager
+def _enter(span):
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        _current_span.reset(token)
+
+
+@contextmanager
+def start_trace(name, **attributes):
+    """
+    Start a new trace with a root span, sampled at the configured rate.
+    Spans are exported when the root span ends. Yields the root span,
+    or None if the trace wasn't sampled.
+    """
+    sample_rate = _settings["sample_rate"]
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        # Make sure spans below an unsampled root don't attach to an outer trace
+        token = _current_span.set(None)
+        try:
+            yield None
+        finally:
+            _current_span.reset(token)
+        return
+
+    trace = Trace()
+    root = Span(trace, name, attributes=attributes)
+    trace.spans.append(root)
+    try:
+        with _enter(root):
+            yield root
+    finally:
+        export_trace(trace)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Record a child span of the current span. A no-op outside a sampled trace.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(parent.trace, name, parent_id=parent.span_id, attributes=attributes)
+    parent.trace.spans.append(child)
+    with _enter(child):
+        yield child
+
+
+def _to_otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(trace):
+    """
+    Convert a trace to an OTLP/JSON ExportTraceServiceRequest.
+    """
+    spans = []
+    for s in trace.spans:
+        otlp_span = {
+            "traceId": trace.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns or s.start_ns),
+            "attributes": [{"key": key, "value": _to_otlp_value(value)} for key, value in s.attributes.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_id:
+            otlp_span["parentSpanId"] = s.parent_id
+        spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [{"key": "service.name", "value": {"stringValue": _settings["service_name"]}}],
+                },
+                "scopeSpans": [{"scope": {"name": "disgrok.tracing"}, "spans": spans}],
+            }
+        ]
+    }
+
+
+def _write_export(path, trace_id, text):
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(text)
+    except OSError as e:
+        print(f"Error exporting trace {trace_id}: {e}")
+
+
+def export_trace(trace):
+    """
+    Serialize the trace now and append it to the export file on the
+    export thread, so the caller never waits on the disk.
+    """
+    if _settings["export_format"] == "otlp":
+        lines = [json.dumps(to_otlp(trace))]
+    else:
+        lines = [json.dumps(s.to_dict()) for s in trace.spans]
+    _export_executor.submit(_write_export, _settings["export_path"], trace.trace_id, "\n".join(lines) + "\n")
+
+
+def flush():
+    """
+    Wait until every trace exported so far has been written.
+    """
+    _export_executor.submit(lambda: None).result()